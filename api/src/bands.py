@@ -0,0 +1,176 @@
+"""
+Triggers compiled into per-ticker price bands.
+
+A trigger fires when the price leaves the band around its reference price:
+INCREASE triggers above reference * (1 + threshold), DECREASE triggers
+below reference * (1 - threshold). Edges of all bands of a ticker are kept
+sorted, so fired triggers for a new price are found with a binary search.
+"""
+import bisect
+import itertools
+import threading
+from functools import lru_cache
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from api.src import schemas
+
+# Relative tolerance used to select candidates around the edge, the exact
+# Trigger.is_triggered check decides on candidates close to it
+EDGE_TOLERANCE = 1e-9
+
+
+@dataclass(frozen=True)
+class Band:
+    edge: float
+    reference_price: float
+    trigger: schemas.Trigger
+    position: schemas.PortfolioPosition
+
+    def is_triggered(self, price: float) -> bool:
+        return self.trigger._is_triggered_by_reference(self.reference_price, price)
+
+
+def get_reference_price(
+    trigger: schemas.Trigger, position: schemas.PortfolioPosition
+) -> Optional[float]:
+    if trigger.reference == schemas.TriggerReference.PORTFOLIO:
+        return position.portfolio_price
+    return position.get_candle_price(trigger.reference.value)
+
+
+def create_band(
+    trigger: schemas.Trigger, position: schemas.PortfolioPosition
+) -> Optional[Band]:
+    """
+    Return band of a trigger for a position or None if it can never fire.
+    """
+    reference_price = get_reference_price(trigger, position)
+    if not reference_price:
+        return None
+    ratio = trigger.threshold / 100
+    if trigger.direction == schemas.Direction.INCREASE:
+        edge = reference_price * (1 + ratio)
+    else:
+        edge = reference_price * (1 - ratio)
+        if edge <= 0:
+            return None
+    return Band(edge, reference_price, trigger, position)
+
+
+class BandIndex:
+    """
+    Sorted band edges of every ticker, updated incrementally as positions
+    and triggers change.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._counter = itertools.count()
+        self._positions: Dict[int, List[schemas.PortfolioPosition]] = {}
+        self._triggers: Dict[int, schemas.Trigger] = {}
+        self._user_triggers: Dict[int, Set[int]] = {}
+        # Ticker -> sorted (edge, sequence, band) for INCREASE and DECREASE triggers
+        self._upper: Dict[str, List[Tuple[float, int, Band]]] = {}
+        self._lower: Dict[str, List[Tuple[float, int, Band]]] = {}
+        # Trigger ID -> entries, used for deletion
+        self._entries: Dict[int, List[Tuple[float, int, Band]]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._entries.values())
+
+    def set_user(
+        self,
+        user_id: int,
+        triggers: Iterable[schemas.Trigger],
+        positions: List[schemas.PortfolioPosition],
+    ) -> None:
+        """
+        Replace triggers and positions of a user.
+        """
+        with self._lock:
+            for trigger in self.get_user_triggers(user_id):
+                self.remove_trigger(trigger.id)
+            self._positions[user_id] = positions
+            for trigger in triggers:
+                self.add_trigger(trigger)
+
+    def set_positions(
+        self, user_id: int, positions: List[schemas.PortfolioPosition]
+    ) -> None:
+        with self._lock:
+            self.set_user(user_id, self.get_user_triggers(user_id), positions)
+
+    def get_user_triggers(self, user_id: int) -> List[schemas.Trigger]:
+        with self._lock:
+            ids = self._user_triggers.get(user_id, ())
+            return [self._triggers[trigger_id] for trigger_id in ids]
+
+    def get_trigger_ids(self) -> Set[int]:
+        with self._lock:
+            return set(self._triggers)
+
+    def get_positions(self, user_id: int) -> List[schemas.PortfolioPosition]:
+        with self._lock:
+            return list(self._positions.get(user_id, []))
+
+    def add_trigger(self, trigger: schemas.Trigger) -> None:
+        """
+        Add bands of a trigger for every matching position of its user.
+        """
+        with self._lock:
+            if trigger.id in self._triggers:
+                self.remove_trigger(trigger.id)
+            self._triggers[trigger.id] = trigger
+            self._user_triggers.setdefault(trigger.user_id, set()).add(trigger.id)
+            entries = self._entries.setdefault(trigger.id, [])
+            for position in self._positions.get(trigger.user_id, []):
+                if trigger.ticker and trigger.ticker != position.ticker:
+                    continue
+                band = create_band(trigger, position)
+                if band is None:
+                    continue
+                entry = (band.edge, next(self._counter), band)
+                bisect.insort(self._get_edges(trigger, position.ticker), entry)
+                entries.append(entry)
+
+    def remove_trigger(self, trigger_id: int) -> None:
+        with self._lock:
+            trigger = self._triggers.pop(trigger_id, None)
+            if trigger is not None:
+                self._user_triggers[trigger.user_id].discard(trigger_id)
+            for entry in self._entries.pop(trigger_id, []):
+                edges = self._get_edges(trigger, entry[2].position.ticker)
+                idx = bisect.bisect_left(edges, entry[:2])
+                if idx < len(edges) and edges[idx][:2] == entry[:2]:
+                    del edges[idx]
+
+    def fired(self, ticker: str, price: float) -> List[Band]:
+        """
+        Return bands of a ticker that fire at the given price.
+        """
+        with self._lock:
+            upper = self._upper.get(ticker, [])
+            lower = self._lower.get(ticker, [])
+            high = price * (1 + EDGE_TOLERANCE)
+            low = price * (1 - EDGE_TOLERANCE)
+            end = bisect.bisect_right(upper, (high, float("inf")))
+            start = bisect.bisect_left(lower, (low, -1))
+            candidates = [e[2] for e in upper[:end]] + [e[2] for e in lower[start:]]
+        return [band for band in candidates if band.is_triggered(price)]
+
+    def _get_edges(
+        self, trigger: schemas.Trigger, ticker: str
+    ) -> List[Tuple[float, int, Band]]:
+        edges = self._lower
+        if trigger.direction == schemas.Direction.INCREASE:
+            edges = self._upper
+        return edges.setdefault(ticker, [])
+
+
+@lru_cache()
+def get_band_index() -> BandIndex:
+    """
+    Return process-wide index shared by the bot and the price feed.
+    """
+    return BandIndex()
@@ -1,10 +1,13 @@
 """
 Commands available for the bot.
 """
-import sys
+import argparse
+from typing import Optional
+from datetime import timedelta
+from concurrent.futures import Future
 
-from sqlalchemy.orm.session import Session
-from telegram import Update, ParseMode
+from loguru import logger
+from telegram import Message, Update, ParseMode
 from telegram.ext import (
     Updater,
     CommandHandler,
@@ -16,7 +19,9 @@ from telegram.ext import (
 
 from api.src.config import settings
 from api.src.keyboards import MARKUPS
-from api.src import database, schemas, tinkoff, utils
+from api.src.cache import IdentityCache
+from api.src import database, profiling, schemas, utils
+from api.src.snapshots import get_snapshot_store, start_refresher
 
 
 (
@@ -29,6 +34,22 @@ from api.src import database, schemas, tinkoff, utils
     ALERTS,
 ) = range(7)
 
+ALERTS_PAGE_SIZE = 10
+identities = IdentityCache(settings.IDENTITY_CACHE_TTL)
+
+
+def get_user(update: Update) -> Optional[schemas.User]:
+    """
+    Return registered user who sent the update, cached by Telegram user ID.
+    """
+    from_user = update.message.from_user
+
+    def load() -> Optional[schemas.User]:
+        with database.get_db_session() as session:
+            return utils.get_user_by_username(from_user.username, session)
+
+    return identities.get_user(from_user.id, load)
+
 
 def format_trigger(idx: int, trigger: schemas.Trigger) -> str:
     """
@@ -55,39 +76,56 @@ def format_position(idx: int, position: schemas.PortfolioPosition) -> str:
     return f"{idx+1}. {position.ticker} <b>{prefix}{delta}%</b>\n"
 
 
-def format_alert(idx: int, alert: schemas.Alert, session: Session) -> str:
+def format_age(age: timedelta) -> str:
+    minutes = int(age.total_seconds() // 60)
+    if minutes < 1:
+        return "just now"
+    if minutes < 60:
+        return f"{minutes} min ago"
+    return f"{minutes // 60} h {minutes % 60} min ago"
+
+
+def format_snapshot(snapshot: schemas.PositionSnapshot) -> str:
     """
-    Convert database Alert model into Telegram message.
+    Convert PositionSnapshot into Telegram message.
     """
-    created_at = alert.created_at.strftime("%b'%d %H:%M:%S")
-    trigger_str = "Trigger no longer present in the database"
-    trigger: database.Trigger = (
-        session.query(database.Trigger)
-        .filter(database.Trigger.id == alert.trigger_id)
-        .first()
+    message = ""
+    for i, position in enumerate(snapshot.positions):
+        message += format_position(i, position)
+    return (
+        f"Here is a list of your positions:\n{message}"
+        f"<i>Updated {format_age(snapshot.age)}</i>"
     )
+
+
+def format_alert(idx: int, details: schemas.AlertDetails) -> str:
+    """
+    Convert AlertDetails into Telegram message.
+    """
+    created_at = details.alert.created_at.strftime("%b'%d %H:%M:%S")
+    trigger_str = "Trigger no longer present in the database"
+    trigger = details.trigger
     if trigger:
         ticker = "All markets" if trigger.ticker is None else trigger.ticker
-        trigger_str = f"{ticker} {trigger.direction.lower()} > {trigger.threshold}%"
+        direction = trigger.direction.value.lower()
+        trigger_str = f"{ticker} {direction} > {trigger.threshold}%"
     return f"{idx+1}. {created_at} - {trigger_str}\n"
 
 
 def start(update: Update, context: CallbackContext) -> int:
-    username = update.message.from_user.username
-    with database.get_db_session() as session:
-        user = utils.get_user_by_username(username, session)
-        if not user:
-            update.message.reply_text(
-                "I don't know you, wanna sign up?",
-                reply_markup=MARKUPS["yes_no"],
-            )
-            return USER_CREATION
-        context.user_data["user_id"] = user.id
+    user = get_user(update)
+    if not user:
         update.message.reply_text(
-            f"Yo, {username}!",
-            reply_markup=MARKUPS["start"],
+            "I don't know you, wanna sign up?",
+            reply_markup=MARKUPS["yes_no"],
         )
-        return CHOOSING
+        return USER_CREATION
+    context.user_data["user_id"] = user.id
+    update.message.reply_text(
+        f"Yo, {user.username}!",
+        reply_markup=MARKUPS["start"],
+    )
+    return CHOOSING
 
 
 def request_token(update: Update, context: CallbackContext) -> int:
@@ -115,10 +153,11 @@ def create_user(update: Update, context: CallbackContext) -> int:
         session.flush()
         session.refresh(user_model)
         context.user_data["user_id"] = user_model.id
-        update.message.reply_text(
-            f"Nice to meet you, {username}",
-            reply_markup=MARKUPS["start"],
-        )
+    identities.invalidate(update.message.from_user.id)
+    update.message.reply_text(
+        f"Nice to meet you, {username}",
+        reply_markup=MARKUPS["start"],
+    )
     return CHOOSING
 
 
@@ -136,29 +175,46 @@ def status(update: Update, context: CallbackContext) -> int:
 def get_positions(update: Update, context: CallbackContext) -> int:
     """
     Return positions for the user.
+    A stored snapshot is sent right away, otherwise positions are fetched
+    in the background and the reply is edited once they arrive.
     """
-    with database.get_db_session() as session:
-        username = update.message.from_user.username
-        user = utils.get_user_by_username(username, session)
-        positions = tinkoff.get_user_positions(user)
-        message = ""
-        for i, position in enumerate(positions):
-            message += format_position(i, position)
+    user = get_user(update)
+    store = get_snapshot_store()
+    snapshot = store.get(user)
+    if snapshot is not None:
         update.message.reply_text(
-            f"Here is a list of your positions:\n{message}",
+            format_snapshot(snapshot),
             reply_markup=MARKUPS["start"],
             parse_mode=ParseMode.HTML,
         )
         return CHOOSING
+    message = update.message.reply_text(
+        "Fetching your positions...",
+        reply_markup=MARKUPS["start"],
+    )
+    future = store.refresh(user)
+    future.add_done_callback(lambda f: edit_positions(message, f))
+    return CHOOSING
+
+
+def edit_positions(message: Message, future: Future) -> None:
+    """
+    Replace the placeholder reply with fetched positions.
+    """
+    try:
+        text = format_snapshot(future.result())
+    except Exception as e:
+        logger.error(f"Failed to fetch positions: {e!r}")
+        text = "Failed to fetch your positions, try again later"
+    message.edit_text(text, parse_mode=ParseMode.HTML)
 
 
 def get_triggers(update: Update, context: CallbackContext) -> int:
     """
     Return triggers for the user.
     """
+    user = get_user(update)
     with database.get_db_session() as session:
-        username = update.message.from_user.username
-        user = utils.get_user_by_username(username, session)
         triggers = utils.get_user_triggers(user.id, session)
         if triggers:
             message = ""
@@ -255,7 +311,8 @@ def process_market(update: Update, context: CallbackContext) -> int:
         "threshold": context.user_data["threshold"],
     }
     with database.get_db_session() as session:
-        session.add(database.Trigger(**trigger))
+        trigger_model = database.Trigger(**trigger)
+        session.add(trigger_model)
         session.commit()
     update.message.reply_text(
         "Trigger created",
@@ -289,24 +346,45 @@ def process_trigger_idx(update: Update, context: CallbackContext) -> int:
 
 
 def get_alerts(update: Update, context: CallbackContext) -> int:
+    context.user_data.pop("alerts_after", None)
+    context.user_data["alerts_shown"] = 0
+    return send_alerts_page(update, context)
+
+
+def get_more_alerts(update: Update, context: CallbackContext) -> int:
+    return send_alerts_page(update, context)
+
+
+def send_alerts_page(update: Update, context: CallbackContext) -> int:
+    """
+    Send the next page of alerts, offer "More" while older alerts exist.
+    """
     user_id = context.user_data["user_id"]
+    after = context.user_data.get("alerts_after")
     with database.get_db_session() as session:
-        alerts = utils.get_user_alerts(user_id, session)
-        if not alerts:
-            update.message.reply_text(
-                "You don't have alerts",
-                reply_markup=MARKUPS["start"],
-            )
-            return CHOOSING
-        else:
-            message = ""
-            for i, alert in enumerate(alerts):
-                message += format_alert(i, alert, session)
-            update.message.reply_text(
-                f"Here is a list of recent alerts:\n{message}",
-                reply_markup=MARKUPS["start"],
-            )
-            return CHOOSING
+        alerts = utils.get_user_alerts(user_id, session, after, ALERTS_PAGE_SIZE + 1)
+    has_more = len(alerts) > ALERTS_PAGE_SIZE
+    alerts = alerts[:ALERTS_PAGE_SIZE]
+    if not alerts:
+        update.message.reply_text(
+            "You don't have alerts",
+            reply_markup=MARKUPS["start"],
+        )
+        return CHOOSING
+    shown = context.user_data.get("alerts_shown", 0)
+    message = ""
+    for i, details in enumerate(alerts, start=shown):
+        message += format_alert(i, details)
+    context.user_data["alerts_shown"] = shown + len(alerts)
+    title = "Here is a list of recent alerts" if after is None else "Older alerts"
+    if has_more:
+        last = alerts[-1].alert
+        context.user_data["alerts_after"] = (last.created_at, last.id)
+    update.message.reply_text(
+        f"{title}:\n{message}",
+        reply_markup=MARKUPS["alerts" if has_more else "start"],
+    )
+    return ALERTS if has_more else CHOOSING
 
 
 def home(update: Update, context: CallbackContext) -> int:
@@ -355,6 +433,9 @@ def main(mode: schemas.ServerStartMode) -> None:
                 process_market,
             ),
         ],
+        ALERTS: [
+            MessageHandler(Filters.regex(r"^(More)$"), get_more_alerts),
+        ],
         TRIGGER_DELETION: [
             MessageHandler(Filters.regex(r"^(\d+(\.\d+)?)$"), process_trigger_idx),
         ],
@@ -365,6 +446,8 @@ def main(mode: schemas.ServerStartMode) -> None:
         fallbacks=[MessageHandler(Filters.regex("^Home$"), home)],
     )
     dispatcher.add_handler(conv_handler)
+    if settings.POSITIONS_REFRESH_INTERVAL:
+        start_refresher(get_snapshot_store())
     if mode == schemas.ServerStartMode.WEBHOOK:
         updater.start_webhook(listen="0.0.0.0", port=5000, url_path=settings.BOT_TOKEN)
         updater.bot.setWebhook(
@@ -374,11 +457,23 @@ def main(mode: schemas.ServerStartMode) -> None:
     else:
         updater.start_polling()
         print(">> Bot started")
-        updater.idle()
+    updater.idle()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run Telegram bot")
+    parser.add_argument(
+        "mode",
+        nargs="?",
+        default=schemas.ServerStartMode.POLLING.value,
+        type=str.upper,
+        choices=[m.value for m in schemas.ServerStartMode],
+    )
+    profiling.add_arguments(parser)
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    mode = schemas.ServerStartMode.POLLING
-    if len(sys.argv) == 2:
-        mode = schemas.ServerStartMode[sys.argv[1].upper()]
-    main(mode)
+    args = parse_args()
+    with profiling.profile_if_requested("bot", args):
+        main(schemas.ServerStartMode[args.mode])
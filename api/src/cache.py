@@ -0,0 +1,120 @@
+"""
+In-memory caches shared between users within a sweep.
+"""
+import time
+import threading
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+
+class TTLCache:
+    """
+    Dictionary-like cache where every entry expires `ttl` seconds after being set.
+    """
+
+    def __init__(self, ttl: float, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._data: Dict[Hashable, Tuple[float, Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= self._clock():
+                self._data.pop(key, None)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._data[key] = (self._clock() + ttl, value)
+
+    def purge(self) -> None:
+        """
+        Drop expired entries.
+        """
+        now = self._clock()
+        with self._lock:
+            for key in [k for k, (expires, _) in self._data.items() if expires <= now]:
+                del self._data[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self)}
+
+
+class MarketDataCache(TTLCache):
+    """
+    Market data shared by all users of a sweep, so every instrument is requested
+    from upstream once no matter how many users hold it.
+    Candle prices are keyed by FIGI and candle range, current prices by ticker.
+    Current prices are only valid within a sweep, long-running processes call
+    clear_prices before every sweep and keep candle prices until they expire.
+    Without sweeps current prices expire after `price_ttl` seconds instead.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        clock: Callable[[], float] = time.monotonic,
+        price_ttl: Optional[float] = None,
+    ):
+        super().__init__(ttl, clock)
+        self.price_ttl = price_ttl
+
+    def get_candle_prices(
+        self, figi: str, candle_ranges: Iterable[str]
+    ) -> Optional[Dict[str, float]]:
+        prices = {}
+        for candle_range in candle_ranges:
+            price = self.get(("candle", figi, candle_range))
+            if price is None:
+                return None
+            prices[candle_range] = price
+        return prices
+
+    def set_candle_prices(self, figi: str, prices: Dict[str, float]) -> None:
+        for candle_range, price in prices.items():
+            self.set(("candle", figi, candle_range), price)
+
+    def get_price(self, ticker: str) -> Optional[float]:
+        return self.get(("price", ticker))
+
+    def set_price(self, ticker: str, price: float) -> None:
+        self.set(("price", ticker), price, self.price_ttl)
+
+    def clear_prices(self) -> None:
+        with self._lock:
+            for key in [k for k in self._data if k[0] == "price"]:
+                del self._data[key]
+
+
+class IdentityCache(TTLCache):
+    """
+    Registered users keyed by Telegram user ID, unknown users are not cached.
+    """
+
+    def get_user(self, telegram_id: int, load: Callable[[], Optional[Any]]) -> Any:
+        user = self.get(telegram_id)
+        if user is None:
+            user = load()
+            if user is not None:
+                self.set(telegram_id, user)
+        return user
+
+    def invalidate(self, telegram_id: int) -> None:
+        with self._lock:
+            self._data.pop(telegram_id, None)
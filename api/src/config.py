@@ -19,6 +19,45 @@ class Settings(BaseSettings):
     BOT_TOKEN: str = os.environ.get("BOT_TOKEN")
     CERTIFICATE = f"{ROOT_PATH}/configs/id_rsa.pub"
     SERVER_IP: str = os.environ.get("SERVER_IP")
+    MARKET_CACHE_TTL: float = 300  # Seconds candle prices are kept between sweeps
+    SWEEP_INTERVAL: float = 300  # Seconds between sweeps in daemon mode
+    SWEEP_CONCURRENCY: int = 20  # Concurrent upstream requests in async sweep
+    SWEEP_TOKEN_CONCURRENCY: int = 2  # Concurrent upstream requests per token
+    SWEEP_USER_DEADLINE: float = 30  # Seconds to fetch positions of one user
+    DELIVERY_WORKERS: int = 4  # Threads sending Telegram messages
+    DELIVERY_COALESCE_WINDOW: float = 2  # Seconds alerts of a chat are merged
+    TELEGRAM_CHAT_RATE: float = 1  # Messages per second to the same chat
+    TELEGRAM_GLOBAL_RATE: float = 30  # Messages per second in total
+    MARKET_LIST_CHUNK_SIZE: int = 100  # Tickers per trading/*/list request
+    MARKET_LIST_WORKERS: int = 4  # Concurrent trading/*/list requests
+    TINKOFF_API_URL: str = "https://api-invest.tinkoff.ru/openapi"
+    TINKOFF_TRADING_URL: str = "https://www.tinkoff.ru/api/trading"
+    HTTP_CONNECT_TIMEOUT: float = 5
+    HTTP_READ_TIMEOUT: float = 20
+    HTTP_POOL_SIZE: int = 20  # Keep-alive connections per host
+    TINKOFF_CLIENT_POOL_SIZE: int = 100  # Clients kept for reuse, one per token
+    SQLITE_JOURNAL_MODE: str = "WAL"  # Lets the bot read while the sweep writes
+    SQLITE_SYNCHRONOUS: str = "NORMAL"
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024
+    SQLITE_CACHE_SIZE: int = -64000  # Negative value is size in KiB
+    SQLITE_BUSY_TIMEOUT: float = 30  # Seconds to wait for a lock
+    SQLITE_POOL_SIZE: int = 5
+    IDENTITY_CACHE_TTL: float = 3600  # Seconds bot users are kept in memory
+    POSITIONS_WORKERS: int = 8  # Threads fetching positions for the bot
+    POSITIONS_SNAPSHOT_TTL: float = 600  # Seconds a snapshot is served as fresh
+    POSITIONS_SNAPSHOT_MAX_STALE: float = 3600  # Seconds it is served while refreshed
+    POSITIONS_REFRESH_INTERVAL: float = 0  # Seconds between refreshes, 0 disables
+    POSITIONS_REFRESH_AHEAD: float = 120  # Seconds before expiry to refresh
+    POSITIONS_REFRESH_ACTIVE: float = 3600  # Refresh users read within seconds
+    POSITIONS_PRICE_TTL: float = 60  # Seconds the bot reuses current prices
+    METRICS_PATH: str = ""  # File metrics are written to after every sweep
+    METRICS_PORT: int = 0  # Port of the metrics endpoint in daemon mode, 0 disables
+    PROFILE_PATH: str = f"{ROOT_PATH}/profiles"  # Output of --profile
+    PROFILE_SAMPLE_INTERVAL: float = 0.005  # Seconds between stack samples
+    STREAMING_REFRESH_INTERVAL: float = 300  # Seconds between portfolio reloads
+    STREAMING_TRIGGERS_POLL_INTERVAL: float = 5  # Seconds between trigger checks
+    TINKOFF_STREAMING_TOKEN: str = ""  # Defaults to the token of the first user
+    TINKOFF_STREAMING_URL: str = ""  # Overrides tinvest streaming endpoint
 
     class Config:
         env_file = f"{ROOT_PATH}/configs/.{ENVIRONMENT}.env"
@@ -0,0 +1,101 @@
+"""
+In-memory alert cooldowns.
+"""
+import threading
+from datetime import datetime
+from typing import Callable, ContextManager, Dict, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import func
+from sqlalchemy.orm.session import Session
+
+from api.src import database, schemas, utils
+
+
+class AlertCooldowns:
+    """
+    Time of the latest alert of every (trigger, ticker) pair.
+    Loaded with one query per sweep, or kept by a long-running process,
+    and updated as alerts are saved.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest: Dict[Tuple[int, Optional[str]], datetime] = {}
+
+    def __len__(self) -> int:
+        return len(self._latest)
+
+    @classmethod
+    def load(cls, session: Session) -> "AlertCooldowns":
+        cooldowns = cls()
+        since = datetime.utcnow() - max(utils.ALERT_WINDOWS.values())
+        rows = (
+            session.query(
+                database.Alert.trigger_id,
+                database.Alert.ticker,
+                func.max(database.Alert.created_at),
+            )
+            .filter(database.Alert.created_at > since)
+            .group_by(database.Alert.trigger_id, database.Alert.ticker)
+        )
+        for trigger_id, ticker, created_at in rows:
+            cooldowns.record(trigger_id, ticker, created_at)
+        return cooldowns
+
+    def record(
+        self, trigger_id: int, ticker: Optional[str], created_at: datetime
+    ) -> None:
+        key = (trigger_id, ticker)
+        with self._lock:
+            if key not in self._latest or self._latest[key] < created_at:
+                self._latest[key] = created_at
+
+    def forget(
+        self, trigger_id: int, ticker: Optional[str], created_at: datetime
+    ) -> None:
+        """
+        Drop the alert recorded at `created_at` if it is still the latest one.
+        """
+        key = (trigger_id, ticker)
+        with self._lock:
+            if self._latest.get(key) == created_at:
+                del self._latest[key]
+
+    def should_ignore(
+        self, trigger: schemas.Trigger, ticker: str, now: Optional[datetime] = None
+    ) -> bool:
+        """
+        Same as utils.should_ignore without querying the database.
+        """
+        latest = self._latest.get((trigger.id, ticker))
+        if latest is None:
+            return False
+        now = datetime.utcnow() if now is None else now
+        return latest > now - utils.get_alert_window(trigger.reference)
+
+    def purge(self, now: Optional[datetime] = None) -> None:
+        """
+        Forget alerts older than the longest window.
+        """
+        now = datetime.utcnow() if now is None else now
+        since = now - max(utils.ALERT_WINDOWS.values())
+        with self._lock:
+            for key in [k for k, v in self._latest.items() if v <= since]:
+                del self._latest[key]
+
+
+def undo_alert(
+    cooldowns: AlertCooldowns,
+    trigger_id: int,
+    ticker: Optional[str],
+    created_at: datetime,
+    session_factory: Callable[[], ContextManager[Session]] = database.get_db_session,
+) -> None:
+    """
+    Forget an alert that could not be delivered, so it fires on the next check.
+    """
+    logger.warning(f"Alert of trigger {trigger_id} for {ticker} not delivered")
+    cooldowns.forget(trigger_id, ticker, created_at)
+    with session_factory() as session:
+        utils.delete_alert(trigger_id, ticker, created_at, session)
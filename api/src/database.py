@@ -1,14 +1,27 @@
 """
 SQLAlchemy table models.
 """
-from typing import Iterator
+import os
+import threading
+from typing import Dict, Iterator
 from datetime import datetime as dt
 from contextlib import contextmanager
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, TIMESTAMP, Float, ForeignKey
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    Text,
+    TIMESTAMP,
+    Float,
+    ForeignKey,
+    Index,
+)
 
 from api.src.config import settings
 
@@ -17,6 +30,7 @@ Base = declarative_base()
 USERS_TABLE = "users"
 ALERTS_TABLE = "alerts"
 TRIGGERS_TABLE = "triggers"
+POSITION_SNAPSHOTS_TABLE = "position_snapshots"
 
 
 class Trigger(Base):
@@ -28,13 +42,15 @@ class Trigger(Base):
     reference = Column(String(16), nullable=False)
     direction = Column(String(16), nullable=False)
     threshold = Column(Float, nullable=False)
-    created_at = Column(TIMESTAMP, default=dt.utcnow(), nullable=False)
-    updated_at = Column(TIMESTAMP, default=dt.utcnow(), nullable=False)
+    created_at = Column(TIMESTAMP, default=dt.utcnow, nullable=False)
+    updated_at = Column(TIMESTAMP, default=dt.utcnow, nullable=False)
 
     user_id = Column(
         Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False
     )
 
+    __table_args__ = (Index("ix_triggers_user_id_ticker", "user_id", "ticker"),)
+
 
 class Alert(Base):
     __tablename__ = ALERTS_TABLE
@@ -42,8 +58,8 @@ class Alert(Base):
     id = Column(Integer, primary_key=True)
 
     ticker = Column(String(16))
-    created_at = Column(TIMESTAMP, default=dt.utcnow(), nullable=False)
-    updated_at = Column(TIMESTAMP, default=dt.utcnow(), nullable=False)
+    created_at = Column(TIMESTAMP, default=dt.utcnow, nullable=False)
+    updated_at = Column(TIMESTAMP, default=dt.utcnow, nullable=False)
 
     trigger_id = Column(
         Integer, ForeignKey("triggers.id", ondelete="CASCADE"), nullable=False
@@ -52,6 +68,16 @@ class Alert(Base):
         Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False
     )
 
+    __table_args__ = (
+        Index(
+            "ix_alerts_trigger_id_ticker_created_at",
+            "trigger_id",
+            "ticker",
+            "created_at",
+        ),
+        Index("ix_alerts_user_id_created_at", "user_id", "created_at"),
+    )
+
 
 class User(Base):
     __tablename__ = USERS_TABLE
@@ -61,15 +87,64 @@ class User(Base):
     token = Column(String(96), nullable=False)
     chat_id = Column(String(96), nullable=False)
     username = Column(String(48), nullable=False, unique=True)
-    created_at = Column(TIMESTAMP, default=dt.utcnow(), nullable=False)
-    updated_at = Column(TIMESTAMP, default=dt.utcnow(), nullable=False)
+    created_at = Column(TIMESTAMP, default=dt.utcnow, nullable=False)
+    updated_at = Column(TIMESTAMP, default=dt.utcnow, nullable=False)
+
+
+class PositionSnapshot(Base):
+    __tablename__ = POSITION_SNAPSHOTS_TABLE
+
+    user_id = Column(
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True
+    )
+
+    positions = Column(Text, nullable=False)  # JSON list of positions
+    created_at = Column(TIMESTAMP, default=dt.utcnow, nullable=False)
 
 
-def get_db_engine():
-    engine = create_engine(settings.SQLITE_URI)
+# One engine per process, forked workers must not share pooled connections
+_engines: Dict[int, Engine] = {}
+_engines_lock = threading.Lock()
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA mmap_size={settings.SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size={settings.SQLITE_CACHE_SIZE}")
+    cursor.close()
+
+
+def create_db_engine(uri: str) -> Engine:
+    """
+    Create pooled engine that can be shared between threads.
+    """
+    engine = create_engine(
+        uri,
+        poolclass=QueuePool,
+        pool_size=settings.SQLITE_POOL_SIZE,
+        connect_args={
+            "check_same_thread": False,
+            "timeout": settings.SQLITE_BUSY_TIMEOUT,
+        },
+    )
+    event.listen(engine, "connect", set_sqlite_pragmas)
     return engine
 
 
+def get_db_engine() -> Engine:
+    """
+    Return engine of the current process, created on first use.
+    """
+    pid = os.getpid()
+    if pid not in _engines:
+        with _engines_lock:
+            if pid not in _engines:
+                _engines[pid] = create_db_engine(settings.SQLITE_URI)
+    return _engines[pid]
+
+
 @contextmanager
 def get_db_session(engine=None) -> Iterator[Session]:
     engine = get_db_engine() if not engine else engine
@@ -82,8 +157,12 @@ def get_db_session(engine=None) -> Iterator[Session]:
 
 
 def init_db() -> None:
-    engine = get_db_engine()
-    Base.metadata.create_all(engine)
+    """
+    Create tables or bring an existing database up to date.
+    """
+    from api.src import migrations
+
+    migrations.migrate(get_db_engine())
 
 
 def drop_db() -> None:
@@ -0,0 +1,225 @@
+"""
+Outbound Telegram messages sent in the background.
+"""
+import time
+import queue
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import telegram
+from loguru import logger
+from telegram.error import RetryAfter
+
+from api.src.config import settings
+from api.src.metrics import metrics
+
+
+class RateLimiter:
+    """
+    Token bucket allowing `rate` calls per second with bursts up to `burst`.
+    """
+
+    def __init__(self, rate: float, burst: float = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+        Block until a call is allowed.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                elapsed = now - self._updated_at
+                self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+def send_message(bot: telegram.Bot, chat_id: str, text: str) -> None:
+    bot.sendMessage(chat_id=chat_id, text=text)
+
+
+# Telegram rejects longer messages
+MESSAGE_LIMIT = 4096
+SEPARATOR = "\n\n"
+
+Callback = Callable[[], None]
+
+
+def coalesce(
+    messages: List[Tuple[str, Optional[Callback]]], limit: int = MESSAGE_LIMIT
+) -> List[Tuple[str, List[Callback]]]:
+    """
+    Join messages into as few texts of at most `limit` characters as possible,
+    longer messages are cut. Every text comes with callbacks of its messages.
+    """
+    chunks = []
+    text, callbacks = "", []
+    for message, callback in messages:
+        for start in range(0, max(len(message), 1), limit):
+            end = start + limit
+            part = message[start:end]
+            if text and len(text) + len(SEPARATOR) + len(part) > limit:
+                chunks.append((text, callbacks))
+                text, callbacks = "", []
+            text = f"{text}{SEPARATOR}{part}" if text else part
+            if callback is not None and callback not in callbacks:
+                callbacks.append(callback)
+    if text:
+        chunks.append((text, callbacks))
+    return chunks
+
+
+class DeliveryQueue:
+    """
+    Messages are merged per chat within `coalesce_window` seconds and sent by
+    worker threads respecting per-chat and global Telegram rate limits.
+    Every chat is served by the same worker, so its messages keep their order.
+    Merged texts are split at Telegram's message limit. When a text cannot be
+    sent, the `on_failure` callbacks of its messages are called.
+    """
+
+    def __init__(
+        self,
+        send: Optional[Callable[[str, str], None]] = None,
+        workers: int = settings.DELIVERY_WORKERS,
+        coalesce_window: float = settings.DELIVERY_COALESCE_WINDOW,
+        chat_rate: float = settings.TELEGRAM_CHAT_RATE,
+        global_rate: float = settings.TELEGRAM_GLOBAL_RATE,
+    ):
+        if send is None:
+            bot = telegram.Bot(token=settings.BOT_TOKEN)
+
+            def send(chat_id: str, text: str) -> None:
+                send_message(bot, chat_id, text)
+
+        self.send = send
+        self.sent = 0
+        self.failed = 0
+        self.coalesce_window = coalesce_window
+        self.chat_rate = chat_rate
+        self._global_limiter = RateLimiter(global_rate, burst=max(1, global_rate))
+        self._chat_limiters: Dict[str, RateLimiter] = {}
+        self._pending: Dict[str, Tuple[float, List[Tuple[str, Callback]]]] = {}
+        self._lock = threading.Lock()
+        # Wakes the dispatcher when a message is put or the queue is closed
+        self._changed = threading.Condition(self._lock)
+        self._closed = threading.Event()
+        self._queues: List[queue.Queue] = [queue.Queue() for _ in range(workers)]
+        self._threads = [
+            threading.Thread(target=self._work, args=(q,), daemon=True)
+            for q in self._queues
+        ]
+        self._threads.append(threading.Thread(target=self._dispatch, daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self) -> "DeliveryQueue":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def put(
+        self, chat_id: str, text: str, on_failure: Optional[Callback] = None
+    ) -> None:
+        """
+        Schedule a message without waiting for it to be sent.
+        """
+        with self._lock:
+            _, messages = self._pending.setdefault(chat_id, (time.monotonic(), []))
+            messages.append((text, on_failure))
+            self._changed.notify()
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """
+        Send everything still pending and stop the workers.
+        """
+        self._closed.set()
+        with self._lock:
+            self._changed.notify()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _dispatch(self) -> None:
+        """
+        Move chats whose coalescing window has elapsed to their worker.
+        """
+        while True:
+            with self._lock:
+                closed, ready = self._wait_ready()
+                batches = [(c, self._pending.pop(c)[1]) for c in ready]
+            for chat_id, messages in batches:
+                worker_queue = self._queues[hash(chat_id) % len(self._queues)]
+                for text, callbacks in coalesce(messages):
+                    worker_queue.put((chat_id, text, callbacks))
+            if closed:
+                for worker_queue in self._queues:
+                    worker_queue.put(None)
+                return
+
+    def _wait_ready(self) -> Tuple[bool, List[str]]:
+        """
+        Sleep until a coalescing window elapses or the queue is closed,
+        return whether it is closed and chats ready to be sent.
+        Must be called holding the lock.
+        """
+        while True:
+            closed = self._closed.is_set()
+            now = time.monotonic()
+            ready = [
+                chat_id
+                for chat_id, (created_at, _) in self._pending.items()
+                if closed or created_at + self.coalesce_window <= now
+            ]
+            if ready or closed:
+                return closed, ready
+            timeout = None
+            if self._pending:
+                first = min(created_at for created_at, _ in self._pending.values())
+                timeout = first + self.coalesce_window - now
+            self._changed.wait(timeout)
+
+    def _work(self, worker_queue: queue.Queue) -> None:
+        while True:
+            item = worker_queue.get()
+            if item is None:
+                return
+            chat_id, text, callbacks = item
+            sent = self._deliver(chat_id, text)
+            with self._lock:
+                if sent:
+                    self.sent += 1
+                else:
+                    self.failed += 1
+            if not sent:
+                for callback in callbacks:
+                    try:
+                        callback()
+                    except Exception:
+                        logger.exception("Failure callback raised")
+
+    def _deliver(self, chat_id: str, text: str) -> bool:
+        if chat_id not in self._chat_limiters:
+            self._chat_limiters[chat_id] = RateLimiter(self.chat_rate)
+        while True:
+            self._chat_limiters[chat_id].acquire()
+            self._global_limiter.acquire()
+            try:
+                with metrics.upstream("telegram"):
+                    self.send(chat_id, text)
+                return True
+            except RetryAfter as e:
+                logger.warning(f"Flood limit hit for chat {chat_id}: {e}")
+                time.sleep(float(e.retry_after))
+            except Exception as e:
+                logger.error(f"Failed to send message to chat {chat_id}: {e!r}")
+                return False
@@ -0,0 +1,214 @@
+"""
+Batch trigger evaluation for all users of a sweep.
+"""
+from typing import Dict, Generic, Hashable, List, Optional, Tuple, TypeVar
+
+import numpy as np
+
+from api.src import schemas, bands
+
+
+U = TypeVar("U")
+
+# Columns of the reference price matrix, named after TriggerReference/CandleRange values
+REFERENCE_COLUMNS = ("PORTFOLIO", "CANDLE_1D", "CANDLE_1W", "CANDLE_1M")
+DIRECTIONS = {schemas.Direction.INCREASE: 1, schemas.Direction.DECREASE: -1}
+
+
+class TriggerBatch(Generic[U]):
+    """
+    Triggers and positions of many users evaluated with a few array operations.
+    Produces the same (trigger, position) pairs as calling Trigger.is_triggered
+    for every position and trigger of each user, in the same order.
+    """
+
+    def __init__(self):
+        self._owners: List[U] = []
+        self._triggers: List[schemas.Trigger] = []
+        self._positions: List[schemas.PortfolioPosition] = []
+        self._pair_positions: List[np.ndarray] = []
+        self._pair_triggers: List[np.ndarray] = []
+
+    def __len__(self) -> int:
+        return sum(len(pairs) for pairs in self._pair_positions)
+
+    def add(
+        self,
+        owner: U,
+        triggers: List[schemas.Trigger],
+        positions: List[schemas.PortfolioPosition],
+    ) -> None:
+        """
+        Add triggers and positions of one user.
+        Triggers without ticker ("All markets") are paired with every position.
+        """
+        tickers = {}
+        for i, position in enumerate(positions):
+            tickers.setdefault(position.ticker, i)
+        position_codes = np.array(
+            [tickers[p.ticker] for p in positions], dtype=np.int64
+        )
+        trigger_codes = np.array(
+            [-1 if not t.ticker else tickers.get(t.ticker, -2) for t in triggers],
+            dtype=np.int64,
+        )
+        mask = (trigger_codes[None, :] == -1) | (
+            trigger_codes[None, :] == position_codes[:, None]
+        )
+        position_idx, trigger_idx = np.nonzero(mask)
+        self._pair_positions.append(position_idx + len(self._positions))
+        self._pair_triggers.append(trigger_idx + len(self._triggers))
+        self._owners.extend([owner] * len(triggers))
+        self._triggers.extend(triggers)
+        self._positions.extend(positions)
+
+    def evaluate(self) -> List[Tuple[U, schemas.Trigger, schemas.PortfolioPosition]]:
+        """
+        Return (owner, trigger, position) for every fired pair.
+        """
+        if not len(self):
+            return []
+        position_idx = np.concatenate(self._pair_positions)
+        trigger_idx = np.concatenate(self._pair_triggers)
+        current, references = self._position_arrays()
+        threshold, direction, column = self._trigger_arrays()
+
+        reference_price = references[position_idx, column[trigger_idx]]
+        current_price = current[position_idx]
+        pair_direction = direction[trigger_idx]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            delta = np.abs(1 - current_price / reference_price) * 100
+        fired = delta > threshold[trigger_idx]
+        fired &= ~((pair_direction == 1) & (current_price < reference_price))
+        fired &= ~((pair_direction == -1) & (current_price > reference_price))
+
+        return [
+            (self._owners[t], self._triggers[t], self._positions[p])
+            for p, t in zip(position_idx[fired], trigger_idx[fired])
+        ]
+
+    def _position_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        current = np.array([p.current_price for p in self._positions], dtype=float)
+        references = np.full((len(self._positions), len(REFERENCE_COLUMNS)), np.nan)
+        for i, position in enumerate(self._positions):
+            if position.portfolio_price is not None:
+                references[i, 0] = position.portfolio_price
+            for j, name in enumerate(REFERENCE_COLUMNS[1:], start=1):
+                price = position.get_candle_price(name)
+                if price is not None:
+                    references[i, j] = price
+        return current, references
+
+    def _trigger_arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        threshold = np.array([float(t.threshold) for t in self._triggers])
+        direction = np.array(
+            [DIRECTIONS.get(t.direction, 0) for t in self._triggers], dtype=np.int8
+        )
+        column = np.array(
+            [REFERENCE_COLUMNS.index(t.reference.value) for t in self._triggers],
+            dtype=np.int64,
+        )
+        return threshold, direction, column
+
+
+def get_signature(
+    triggers: List[schemas.Trigger], positions: List[schemas.PortfolioPosition]
+) -> int:
+    """
+    Hash of everything but current prices that evaluation depends on.
+    """
+    trigger_keys = tuple(
+        (t.id, t.ticker, t.reference, t.threshold, t.direction) for t in triggers
+    )
+    position_keys = tuple(
+        (
+            p.ticker,
+            p.portfolio_price,
+            tuple(sorted(p.candle_prices.items())),
+        )
+        for p in positions
+    )
+    return hash((trigger_keys, position_keys))
+
+
+def get_quiet_range(
+    triggers: List[schemas.Trigger], position: schemas.PortfolioPosition
+) -> Optional[Tuple[float, float]]:
+    """
+    Return prices between the nearest band edges around the current price,
+    where no trigger of the position can fire, or None if one fires already.
+    """
+    low, high = 0.0, float("inf")
+    price = position.current_price
+    for trigger in triggers:
+        if trigger.ticker and trigger.ticker != position.ticker:
+            continue
+        band = bands.create_band(trigger, position)
+        if band is None:
+            continue
+        if band.is_triggered(price):
+            return None
+        if band.edge > price:
+            high = min(high, band.edge)
+        elif band.edge < price:
+            low = max(low, band.edge)
+        else:
+            return None
+    return low * (1 + bands.EDGE_TOLERANCE), high * (1 - bands.EDGE_TOLERANCE)
+
+
+class ChangeGate:
+    """
+    Remembers triggers, reference prices and quiet ranges of every user from
+    the last evaluation, so only positions whose price left its quiet range
+    are evaluated again while triggers and portfolio stay the same.
+    Positions with a fired trigger are always evaluated, their alerts are
+    subject to cooldowns that expire over time.
+    """
+
+    def __init__(self):
+        self.evaluated = 0
+        self.skipped = 0
+        self.users_skipped = 0
+        self._state: Dict[Hashable, Tuple[int, Dict[str, Tuple[float, float]]]] = {}
+
+    def select(
+        self,
+        owner_id: Hashable,
+        triggers: List[schemas.Trigger],
+        positions: List[schemas.PortfolioPosition],
+    ) -> List[schemas.PortfolioPosition]:
+        """
+        Return positions that have to be evaluated and remember the new state.
+        """
+        signature = get_signature(triggers, positions)
+        previous_signature, previous_ranges = self._state.get(owner_id, (None, {}))
+        ranges = {}
+        selected = []
+        for position in positions:
+            quiet_range = None
+            if signature == previous_signature:
+                quiet_range = previous_ranges.get(position.ticker)
+            if quiet_range and quiet_range[0] < position.current_price < quiet_range[1]:
+                ranges[position.ticker] = quiet_range
+                continue
+            selected.append(position)
+            quiet_range = get_quiet_range(triggers, position)
+            if quiet_range is not None:
+                ranges[position.ticker] = quiet_range
+        self._state[owner_id] = (signature, ranges)
+        self.evaluated += len(selected)
+        self.skipped += len(positions) - len(selected)
+        if positions and not selected:
+            self.users_skipped += 1
+        return selected
+
+    def forget(self, owner_id: Hashable) -> None:
+        self._state.pop(owner_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "evaluated": self.evaluated,
+            "skipped": self.skipped,
+            "users_skipped": self.users_skipped,
+        }
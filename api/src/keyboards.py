@@ -12,6 +12,7 @@ reference_keyboard = [["Portfolio", "Candle"], ["Home"]]
 candle_keyboard = [["Daily", "Weekly", "Monthly"], ["Home"]]
 only_home_keyboard = [["Home"]]
 market_keyboard = [["All markets"], ["Home"]]
+alerts_keyboard = [["More"], ["Home"]]
 
 MARKUPS = {
     "new_conversation": ReplyKeyboardMarkup(new_conversation, one_time_keyboard=True),
@@ -25,4 +26,5 @@ MARKUPS = {
     "yes_no": ReplyKeyboardMarkup(yes_no_keyboard, one_time_keyboard=True),
     "start": ReplyKeyboardMarkup(start_keyboard, one_time_keyboard=True),
     "empty": ReplyKeyboardMarkup(empty_keyboard, one_time_keyboard=True),
+    "alerts": ReplyKeyboardMarkup(alerts_keyboard, one_time_keyboard=True),
 }
\ No newline at end of file
@@ -0,0 +1,241 @@
+"""
+Process-wide counters and latency histograms exported in Prometheus text format.
+"""
+import os
+import copy
+import time
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from loguru import logger
+
+from api.src.config import settings
+
+
+STAGE_SECONDS = "bicklebow_stage_seconds"
+UPSTREAM_SECONDS = "bicklebow_upstream_seconds"
+UPSTREAM_REQUESTS = "bicklebow_upstream_requests_total"
+UPSTREAM_ERRORS = "bicklebow_upstream_errors_total"
+ALERTS_FIRED = "bicklebow_alerts_fired_total"
+SWEEPS = "bicklebow_sweeps_total"
+SCHEDULER_LAG = "bicklebow_scheduler_lag_seconds"
+SCHEDULER_DURATION = "bicklebow_scheduler_duration_seconds"
+SCHEDULER_SKIPPED = "bicklebow_scheduler_ticks_skipped_total"
+SCHEDULER_FAILED = "bicklebow_scheduler_runs_failed_total"
+DESCRIPTIONS = {
+    STAGE_SECONDS: "Time spent in a stage of the sweep",
+    UPSTREAM_SECONDS: "Latency of upstream requests",
+    UPSTREAM_REQUESTS: "Upstream requests by endpoint",
+    UPSTREAM_ERRORS: "Failed upstream requests by endpoint",
+    ALERTS_FIRED: "Alerts sent to users",
+    SWEEPS: "Finished sweeps",
+    SCHEDULER_LAG: "Delay between scheduled and actual start of a periodic job",
+    SCHEDULER_DURATION: "Time a run of a periodic job took",
+    SCHEDULER_SKIPPED: "Ticks skipped while the previous run was in progress",
+    SCHEDULER_FAILED: "Runs of a periodic job that raised",
+}
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def merge(self, other: "Histogram") -> None:
+        self.count += other.count
+        self.sum += other.sum
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram()
+            self._histograms[key].observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def stage(self, stage: str):
+        """
+        Time a stage of the sweep.
+        """
+        return self.timer(STAGE_SECONDS, stage=stage)
+
+    @contextmanager
+    def upstream(self, endpoint: str) -> Iterator[None]:
+        """
+        Count and time a request to Tinkoff or Telegram.
+        """
+        self.inc(UPSTREAM_REQUESTS, endpoint=endpoint)
+        try:
+            with self.timer(UPSTREAM_SECONDS, endpoint=endpoint):
+                yield
+        except Exception:
+            self.inc(UPSTREAM_ERRORS, endpoint=endpoint)
+            raise
+
+    def snapshot(self) -> Dict[str, float]:
+        """
+        Flat view of counters and histogram totals, used for per-sweep summaries.
+        """
+        values = {}
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                values[format_name(name, labels)] = value
+            for (name, labels), histogram in self._histograms.items():
+                values[format_name(f"{name}_count", labels)] = histogram.count
+                values[format_name(f"{name}_sum", labels)] = histogram.sum
+        return values
+
+    def render(self) -> str:
+        """
+        Return all metrics in Prometheus text exposition format.
+        """
+        lines: List[str] = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+        name = None
+        for (name_, labels), value in counters:
+            if name_ != name:
+                name = name_
+                lines.extend(describe(name, "counter"))
+            lines.append(f"{format_name(name, labels)} {value}")
+        for (name_, labels), histogram in histograms:
+            if name_ != name:
+                name = name_
+                lines.extend(describe(name, "histogram"))
+            lines.extend(render_histogram(name, labels, histogram))
+        return "\n".join(lines) + "\n"
+
+    def dump(self) -> dict:
+        """
+        Picklable copy of all metrics, for worker processes to hand over.
+        """
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "histograms": copy.deepcopy(self._histograms),
+            }
+
+    def merge(self, dump: dict) -> None:
+        """
+        Add metrics dumped by another registry.
+        """
+        with self._lock:
+            for key, value in dump["counters"].items():
+                self._counters[key] = self._counters.get(key, 0) + value
+            for key, histogram in dump["histograms"].items():
+                if key not in self._histograms:
+                    self._histograms[key] = Histogram(histogram.buckets)
+                self._histograms[key].merge(histogram)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+def describe(name: str, kind: str) -> List[str]:
+    return [f"# HELP {name} {DESCRIPTIONS.get(name, name)}", f"# TYPE {name} {kind}"]
+
+
+def format_name(name: str, labels: Labels) -> str:
+    if not labels:
+        return name
+    pairs = ",".join(f'{key}="{value}"' for key, value in labels)
+    return f"{name}{{{pairs}}}"
+
+
+def render_histogram(name: str, labels: Labels, histogram: Histogram) -> List[str]:
+    lines = []
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        bucket_labels = labels + (("le", str(bound)),)
+        lines.append(f"{format_name(f'{name}_bucket', bucket_labels)} {count}")
+    inf_labels = labels + (("le", "+Inf"),)
+    lines.append(f"{format_name(f'{name}_bucket', inf_labels)} {histogram.count}")
+    lines.append(f"{format_name(f'{name}_sum', labels)} {histogram.sum}")
+    lines.append(f"{format_name(f'{name}_count', labels)} {histogram.count}")
+    return lines
+
+
+def get_summary(before: Dict[str, float], after: Dict[str, float]) -> Dict[str, float]:
+    """
+    Return metrics that changed between two snapshots.
+    """
+    summary = {}
+    for name, value in after.items():
+        delta = value - before.get(name, 0)
+        if delta:
+            summary[name] = round(delta, 4)
+    return summary
+
+
+def export(path: Optional[str] = settings.METRICS_PATH) -> None:
+    """
+    Write metrics to a file read by the node exporter textfile collector.
+    """
+    if not path:
+        return
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(metrics.render())
+    os.replace(tmp_path, path)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        body = metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+def start_http_server(port: int = settings.METRICS_PORT) -> ThreadingHTTPServer:
+    """
+    Serve /metrics from a daemon thread.
+    """
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Serving metrics on port {server.server_address[1]}")
+    return server
+
+
+metrics = MetricsRegistry()
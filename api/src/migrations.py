@@ -0,0 +1,64 @@
+"""
+Versioned schema migrations.
+
+Version of the database is stored in SQLite `PRAGMA user_version`.
+Every migration must be idempotent: the first one creates tables from the
+current models, so a fresh database already has objects added later.
+"""
+from typing import Callable, List
+
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from api.src import database
+
+
+def create_tables(connection: Connection) -> None:
+    database.Base.metadata.create_all(connection)
+
+
+def add_hot_query_indexes(connection: Connection) -> None:
+    statements = [
+        "CREATE INDEX IF NOT EXISTS ix_triggers_user_id_ticker "
+        "ON triggers (user_id, ticker)",
+        "CREATE INDEX IF NOT EXISTS ix_alerts_trigger_id_ticker_created_at "
+        "ON alerts (trigger_id, ticker, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_alerts_user_id_created_at "
+        "ON alerts (user_id, created_at)",
+    ]
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+def create_position_snapshots(connection: Connection) -> None:
+    database.PositionSnapshot.__table__.create(connection, checkfirst=True)
+
+
+# Position in the list is the version the database gets after the migration
+MIGRATIONS: List[Callable[[Connection], None]] = [
+    create_tables,
+    add_hot_query_indexes,
+    create_position_snapshots,
+]
+
+
+def get_version(connection: Connection) -> int:
+    return connection.execute(text("PRAGMA user_version")).scalar()
+
+
+def migrate(engine: Engine) -> int:
+    """
+    Apply pending migrations, return the resulting version.
+    """
+    with engine.begin() as connection:
+        version = get_version(connection)
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            logger.info(f"Applying migration {number}: {migration.__name__}")
+            migration(connection)
+            connection.execute(text(f"PRAGMA user_version = {number}"))
+    return max(version, len(MIGRATIONS))
+
+
+if __name__ == "__main__":
+    migrate(database.get_db_engine())
@@ -0,0 +1,52 @@
+"""
+Positions fetched for the bot outside of the dispatcher threads.
+"""
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from api.src import schemas, tinkoff
+from api.src.config import settings
+
+
+class PositionsFetcher:
+    """
+    Fetch positions in a pool of worker threads.
+    Concurrent requests of the same user share one in-flight fetch.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[
+            [schemas.User], List[schemas.PortfolioPosition]
+        ] = tinkoff.get_user_positions,
+        workers: int = settings.POSITIONS_WORKERS,
+    ):
+        self.fetch = fetch
+        self.requests = 0
+        self.fetches = 0
+        self._executor = ThreadPoolExecutor(workers, "positions")
+        self._inflight: Dict[int, Future] = {}
+        self._lock = threading.RLock()
+
+    def submit(self, user: schemas.User) -> Future:
+        """
+        Return future of the user positions.
+        """
+        with self._lock:
+            self.requests += 1
+            future = self._inflight.get(user.id)
+            if future is None:
+                self.fetches += 1
+                future = self._executor.submit(self.fetch, user)
+                self._inflight[user.id] = future
+                future.add_done_callback(lambda _: self._forget(user.id, future))
+            return future
+
+    def shutdown(self) -> None:
+        self._executor.shutdown()
+
+    def _forget(self, user_id: int, future: Future) -> None:
+        with self._lock:
+            if self._inflight.get(user_id) is future:
+                del self._inflight[user_id]
@@ -0,0 +1,143 @@
+"""
+Profiling of CLI entry points without changing their code.
+
+`profile()` runs the wrapped block under cProfile, which only sees the calling
+thread, while a sampling thread records stacks of every thread, so work done
+in worker pools, the delivery queue and bot handlers shows up as well.
+Outputs, named after the entry point and start time:
+- NAME.pstats: cProfile statistics, open with `python -m pstats` or snakeviz
+- NAME.collapsed: folded stacks for flamegraph.pl or speedscope
+- NAME.tracemalloc.txt: top allocation sites when memory profiling is enabled
+"""
+import os
+import sys
+import time
+import cProfile
+import argparse
+import threading
+import tracemalloc
+from datetime import datetime
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+from loguru import logger
+
+from api.src.config import settings
+
+
+class StackSampler:
+    """
+    Record stacks of all threads every `interval` seconds.
+    """
+
+    def __init__(self, interval: float = settings.PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> "StackSampler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def sample(self) -> None:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == self._thread.ident:
+                continue
+            stack: List[str] = []
+            while frame is not None:
+                code = frame.f_code
+                module = os.path.splitext(os.path.basename(code.co_filename))[0]
+                stack.append(f"{module}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            self.samples[";".join(reversed(stack))] += 1
+
+    def write_collapsed(self, path: str) -> None:
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+
+def write_tracemalloc_report(path: str, limit: int = 50) -> None:
+    snapshot = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    with open(path, "w") as f:
+        f.write(f"Current: {current / 2**20:.1f} MiB, peak: {peak / 2**20:.1f} MiB\n")
+        for stat in snapshot.statistics("lineno")[:limit]:
+            f.write(f"{stat}\n")
+
+
+def get_output_paths(name: str, directory: str) -> Dict[str, str]:
+    os.makedirs(directory, exist_ok=True)
+    prefix = os.path.join(directory, f"{name}-{datetime.now():%Y%m%d-%H%M%S}")
+    return {
+        "pstats": f"{prefix}.pstats",
+        "collapsed": f"{prefix}.collapsed",
+        "tracemalloc": f"{prefix}.tracemalloc.txt",
+    }
+
+
+@contextmanager
+def profile(
+    name: str, memory: bool = False, directory: str = settings.PROFILE_PATH
+) -> Iterator[Dict[str, str]]:
+    """
+    Profile the block and write reports, yields paths of the reports.
+    """
+    paths = get_output_paths(name, directory)
+    if memory:
+        tracemalloc.start()
+    sampler = StackSampler().start()
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        yield paths
+    finally:
+        profiler.disable()
+        sampler.stop()
+        profiler.dump_stats(paths["pstats"])
+        sampler.write_collapsed(paths["collapsed"])
+        if memory:
+            write_tracemalloc_report(paths["tracemalloc"])
+            tracemalloc.stop()
+        else:
+            del paths["tracemalloc"]
+        seconds = time.perf_counter() - start
+        logger.info(f"Profiled {name} for {seconds:.1f}s: {list(paths.values())}")
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help=f"Write pstats and collapsed stacks to {settings.PROFILE_PATH}",
+    )
+    parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        help="Also write a tracemalloc report, implies --profile",
+    )
+
+
+@contextmanager
+def profile_if_requested(name: str, args: argparse.Namespace) -> Iterator[None]:
+    """
+    Profile the block when --profile or --profile-memory is given.
+    """
+    if not (args.profile or args.profile_memory):
+        yield
+        return
+    with profile(name, memory=args.profile_memory):
+        yield
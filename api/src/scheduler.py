@@ -0,0 +1,92 @@
+"""
+Periodic job runner for long-running processes.
+"""
+import time
+import threading
+from typing import Any, Callable, Optional
+
+from loguru import logger
+
+from api.src.metrics import (
+    SCHEDULER_DURATION,
+    SCHEDULER_FAILED,
+    SCHEDULER_LAG,
+    SCHEDULER_SKIPPED,
+    metrics,
+)
+
+
+class Scheduler:
+    """
+    Run `job` every `interval` seconds in a background thread.
+    A tick is skipped while the previous run is still in progress.
+    Lag, duration, skipped ticks and failed runs are recorded in metrics
+    labeled with `name`, the name of the job by default.
+    """
+
+    def __init__(
+        self, job: Callable[[], Any], interval: float, name: Optional[str] = None
+    ):
+        self.job = job
+        self.interval = interval
+        self.name = getattr(job, "__name__", "job") if name is None else name
+        self.runs = 0
+        self.skipped = 0
+        self.failed = 0
+        self.lag = 0.0  # Seconds between scheduled and actual start of the last run
+        self.duration = 0.0  # Seconds the last run took
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run(self) -> None:
+        """
+        Block until stop() is called, then wait for the current run to finish.
+        """
+        next_tick = time.monotonic()
+        while not self._stop.is_set():
+            delay = next_tick - time.monotonic()
+            if delay > 0 and self._stop.wait(delay):
+                break
+            now = time.monotonic()
+            if self._thread is not None and self._thread.is_alive():
+                self.skipped += 1
+                metrics.inc(SCHEDULER_SKIPPED, job=self.name)
+                logger.warning("Previous run still in progress, tick skipped")
+            else:
+                self.lag = now - next_tick
+                metrics.observe(SCHEDULER_LAG, self.lag, job=self.name)
+                self._thread = threading.Thread(target=self._run_job)
+                self._thread.start()
+            while next_tick <= now:
+                next_tick += self.interval
+        if self._thread is not None:
+            self._thread.join()
+
+    def stop(self, *args) -> None:
+        """
+        Can be used as a signal handler.
+        """
+        self._stop.set()
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "lag": round(self.lag, 3),
+            "duration": round(self.duration, 3),
+        }
+
+    def _run_job(self) -> None:
+        start = time.monotonic()
+        try:
+            self.job()
+        except Exception:
+            self.failed += 1
+            metrics.inc(SCHEDULER_FAILED, job=self.name)
+            logger.exception("Scheduled run failed")
+        finally:
+            self.duration = time.monotonic() - start
+            metrics.observe(SCHEDULER_DURATION, self.duration, job=self.name)
+            self.runs += 1
+            logger.info(f"Scheduler: {self.stats()}")
@@ -1,6 +1,7 @@
 import datetime
 from enum import Enum
-from typing import Dict, Optional
+from operator import attrgetter
+from typing import Dict, List, Optional
 from dataclasses import dataclass
 
 from tinvest import schemas
@@ -24,23 +25,144 @@ class Direction(Enum):
     DECREASE = "DECREASE"
 
 
+# Slots holding prices of the CandleRange windows
+CANDLE_FIELDS = {
+    CandleRange.CANDLE_1D.value: "candle_1d_price",
+    CandleRange.CANDLE_1W.value: "candle_1w_price",
+    CandleRange.CANDLE_1M.value: "candle_1m_price",
+}
+
+
+class CandlePrices:
+    """
+    Candle prices stored in fixed slots instead of a dict per instance.
+    Prices of windows added with tinkoff.register_candle_window go
+    to `extra_candle_prices`, which stays None when there are none.
+    """
+
+    __slots__ = (
+        "candle_1d_price",
+        "candle_1w_price",
+        "candle_1m_price",
+        "extra_candle_prices",
+    )
+
+    def _set_candle_prices(self, candle_prices: Optional[Dict[str, float]]) -> None:
+        candle_prices = candle_prices or {}
+        self.candle_1d_price = candle_prices.get(CandleRange.CANDLE_1D.value)
+        self.candle_1w_price = candle_prices.get(CandleRange.CANDLE_1W.value)
+        self.candle_1m_price = candle_prices.get(CandleRange.CANDLE_1M.value)
+        extra = {k: v for k, v in candle_prices.items() if k not in CANDLE_FIELDS}
+        self.extra_candle_prices = extra or None
+
+    @property
+    def candle_prices(self) -> Dict[str, float]:
+        prices = {
+            name: getattr(self, attr)
+            for name, attr in CANDLE_FIELDS.items()
+            if getattr(self, attr) is not None
+        }
+        if self.extra_candle_prices:
+            prices.update(self.extra_candle_prices)
+        return prices
+
+    def get_candle_price(self, name: str) -> Optional[float]:
+        attr = CANDLE_FIELDS.get(name)
+        if attr is not None:
+            return getattr(self, attr)
+        if self.extra_candle_prices:
+            return self.extra_candle_prices.get(name)
+        return None
+
+
 @dataclass
-class MarketValue:
+class MarketValue(CandlePrices):
+    __slots__ = ("ticker", "current_price")
     ticker: str
     current_price: float
-    candle_1d_price: float
-    candle_1w_price: float
-    candle_1m_price: float
+    candle_1d_price: Optional[float]
+    candle_1w_price: Optional[float]
+    candle_1m_price: Optional[float]
+    extra_candle_prices: Optional[Dict[str, float]]
+
+    def __init__(
+        self,
+        ticker: str,
+        current_price: float,
+        candle_1d_price: Optional[float] = None,
+        candle_1w_price: Optional[float] = None,
+        candle_1m_price: Optional[float] = None,
+        candle_prices: Optional[Dict[str, float]] = None,
+    ):
+        self.ticker = ticker
+        self.current_price = current_price
+        self._set_candle_prices(candle_prices)
+        if candle_1d_price is not None:
+            self.candle_1d_price = candle_1d_price
+        if candle_1w_price is not None:
+            self.candle_1w_price = candle_1w_price
+        if candle_1m_price is not None:
+            self.candle_1m_price = candle_1m_price
 
 
 @dataclass
-class PortfolioPosition:
+class PortfolioPosition(CandlePrices):
+    __slots__ = ("name", "ticker", "current_price", "portfolio_price")
     name: str
     ticker: str
     current_price: float
-    candle_prices: Dict[str, float]
+    candle_1d_price: Optional[float]
+    candle_1w_price: Optional[float]
+    candle_1m_price: Optional[float]
+    extra_candle_prices: Optional[Dict[str, float]]
     portfolio_price: float
 
+    def __init__(
+        self,
+        name: str,
+        ticker: str,
+        current_price: float,
+        candle_prices: Optional[Dict[str, float]],
+        portfolio_price: float,
+    ):
+        self.name = name
+        self.ticker = ticker
+        self.current_price = current_price
+        self.portfolio_price = portfolio_price
+        self._set_candle_prices(candle_prices)
+
+    @classmethod
+    def from_market_value(
+        cls, name: str, market_value: MarketValue, portfolio_price: float
+    ) -> "PortfolioPosition":
+        position = cls(
+            name, market_value.ticker, market_value.current_price, None, portfolio_price
+        )
+        for attr in CandlePrices.__slots__:
+            setattr(position, attr, getattr(market_value, attr))
+        if market_value.extra_candle_prices:
+            position.extra_candle_prices = dict(market_value.extra_candle_prices)
+        return position
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "ticker": self.ticker,
+            "current_price": self.current_price,
+            "candle_prices": self.candle_prices,
+            "portfolio_price": self.portfolio_price,
+        }
+
+
+@dataclass
+class PositionSnapshot:
+    positions: List[PortfolioPosition]
+    created_at: datetime.datetime
+
+    @property
+    def age(self) -> datetime.timedelta:
+        return datetime.datetime.utcnow() - self.created_at
+
 
 @dataclass
 class User:
@@ -71,6 +193,7 @@ class User:
 
 @dataclass
 class Alert:
+    __slots__ = ("id", "user_id", "trigger_id", "created_at")
     id: int
     user_id: int
     trigger_id: int
@@ -96,8 +219,18 @@ class Alert:
         }
 
 
+# Trigger references and directions by their database values
+REFERENCES: Dict[str, Enum] = {
+    **{candle.value: candle for candle in CandleRange},
+    TriggerReference.PORTFOLIO.value: TriggerReference.PORTFOLIO,
+}
+DIRECTIONS: Dict[str, Direction] = {d.value: d for d in Direction}
+CANDLE_GETTERS = {CandleRange(name): attrgetter(a) for name, a in CANDLE_FIELDS.items()}
+
+
 @dataclass
 class Trigger:
+    __slots__ = ("id", "user_id", "ticker", "reference", "threshold", "direction")
     id: int
     user_id: int
     ticker: Optional[str]  # Market name, e.g. TSLA
@@ -118,11 +251,8 @@ class Trigger:
         self.user_id = user_id
         self.ticker = ticker
         self.threshold = threshold
-        self.direction = Direction[direction]
-        if "CANDLE" in reference:
-            self.reference = CandleRange[reference]
-        else:
-            self.reference = TriggerReference[reference]
+        self.direction = DIRECTIONS[direction]
+        self.reference = REFERENCES[reference]
 
     @classmethod
     def from_model(cls, model: database.Trigger):
@@ -153,8 +283,10 @@ class Trigger:
             return self._is_triggered_by_reference(
                 position.portfolio_price, position.current_price
             )
-        if self.reference in TriggerReference.CANDLE.value:
-            candle_price = position.candle_prices[self.reference.value]
+        if self.reference in CANDLE_GETTERS:
+            candle_price = CANDLE_GETTERS[self.reference](position)
+            if candle_price is None:
+                raise KeyError(self.reference.value)
             return self._is_triggered_by_reference(candle_price, position.current_price)
         raise TypeError(f"Reference {self.reference} unknown")
 
@@ -182,6 +314,12 @@ class Trigger:
         }
 
 
+@dataclass
+class AlertDetails:
+    alert: Alert
+    trigger: Optional[Trigger]  # None if the trigger was deleted
+
+
 class ServerStartMode(Enum):
     POLLING = "POLLING"
     WEBHOOK = "WEBHOOK"
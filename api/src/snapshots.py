@@ -0,0 +1,157 @@
+"""
+Per-user positions snapshots shared by the sweep and the bot.
+"""
+import threading
+from datetime import datetime, timedelta
+from functools import lru_cache
+from concurrent.futures import Future
+from typing import Callable, ContextManager, Dict, List, Optional
+
+from loguru import logger
+from sqlalchemy.orm.session import Session
+
+from api.src import database, schemas, tinkoff, utils
+from api.src.cache import MarketDataCache
+from api.src.config import settings
+from api.src.positions import PositionsFetcher
+from api.src.scheduler import Scheduler
+from api.src.unit_of_work import UnitOfWork
+
+
+class SnapshotStore:
+    """
+    Snapshots are kept in the database, so ones saved by the sweep are read
+    by the bot. A snapshot is fresh for `ttl` seconds, after that it is still
+    served for up to `max_stale` seconds while a refresh runs in the background.
+    Positions are fetched with one MarketDataCache, so users holding the same
+    instruments share candle requests.
+    """
+
+    def __init__(
+        self,
+        fetch: Optional[
+            Callable[[schemas.User], List[schemas.PortfolioPosition]]
+        ] = None,
+        session_factory: Callable[
+            [], ContextManager[Session]
+        ] = database.get_db_session,
+        ttl: float = settings.POSITIONS_SNAPSHOT_TTL,
+        max_stale: float = settings.POSITIONS_SNAPSHOT_MAX_STALE,
+        workers: int = settings.POSITIONS_WORKERS,
+    ):
+        self.cache = MarketDataCache(
+            settings.MARKET_CACHE_TTL, price_ttl=settings.POSITIONS_PRICE_TTL
+        )
+        self.fetch = self._fetch_positions if fetch is None else fetch
+        self.session_factory = session_factory
+        self.ttl = timedelta(seconds=ttl)
+        self.max_stale = timedelta(seconds=max_stale)
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._read_at: Dict[int, datetime] = {}
+        self.fetcher = PositionsFetcher(self._fetch_and_save, workers)
+        self._lock = threading.Lock()
+
+    def get(self, user: schemas.User) -> Optional[schemas.PositionSnapshot]:
+        """
+        Return snapshot that can be served or None if it has to be fetched.
+        """
+        with self._lock:
+            self._read_at[user.id] = datetime.utcnow()
+        with self.session_factory() as session:
+            snapshot = utils.get_position_snapshot(user.id, session)
+        if snapshot is None or snapshot.age > self.max_stale:
+            self._count("misses")
+            return None
+        if snapshot.age > self.ttl:
+            self._count("stale_hits")
+            self.refresh(user)
+        else:
+            self._count("hits")
+        return snapshot
+
+    def refresh(self, user: schemas.User) -> Future:
+        """
+        Fetch and save positions in the background, return future of the snapshot.
+        """
+        return self.fetcher.submit(user)
+
+    def save(
+        self, user: schemas.User, positions: List[schemas.PortfolioPosition]
+    ) -> schemas.PositionSnapshot:
+        with self.session_factory() as session:
+            unit_of_work = UnitOfWork(session)
+            unit_of_work.save_positions(user, positions)
+            unit_of_work.flush()
+        return schemas.PositionSnapshot(positions, datetime.utcnow())
+
+    def refresh_expiring(
+        self,
+        ahead: float = settings.POSITIONS_REFRESH_AHEAD,
+        active: float = settings.POSITIONS_REFRESH_ACTIVE,
+    ) -> int:
+        """
+        Refresh snapshots expiring within `ahead` seconds of users who read
+        their positions within `active` seconds, return their number.
+        Expired snapshots are left to be refreshed on the next read.
+        """
+        now = datetime.utcnow()
+        with self._lock:
+            self._read_at = {
+                user_id: read_at
+                for user_id, read_at in self._read_at.items()
+                if read_at > now - timedelta(seconds=active)
+            }
+            active_ids = set(self._read_at)
+        if not active_ids:
+            return 0
+        with self.session_factory() as session:
+            users = utils.get_users_with_snapshots(
+                session,
+                newer_than=now - self.ttl,
+                older_than=now - self.ttl + timedelta(seconds=ahead),
+            )
+        users = [u for u in users if u.id in active_ids]
+        for user in users:
+            self.refresh(user)
+        return len(users)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "fetches": self.fetcher.fetches,
+        }
+
+    def _fetch_positions(self, user: schemas.User) -> List[schemas.PortfolioPosition]:
+        return tinkoff.get_user_positions(user, self.cache)
+
+    def _fetch_and_save(self, user: schemas.User) -> schemas.PositionSnapshot:
+        return self.save(user, self.fetch(user))
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+
+def start_refresher(
+    store: SnapshotStore, interval: float = settings.POSITIONS_REFRESH_INTERVAL
+) -> Scheduler:
+    """
+    Refresh expiring snapshots every `interval` seconds in a daemon thread.
+    """
+
+    def refresh() -> None:
+        count = store.refresh_expiring()
+        logger.info(f"Refreshing {count} snapshots, store: {store.stats()}")
+
+    scheduler = Scheduler(refresh, interval, name="snapshots")
+    threading.Thread(target=scheduler.run, daemon=True).start()
+    return scheduler
+
+
+@lru_cache()
+def get_snapshot_store() -> SnapshotStore:
+    return SnapshotStore()
@@ -0,0 +1,328 @@
+"""
+Event-driven trigger evaluation from a streaming price feed.
+"""
+import asyncio
+from abc import ABC, abstractmethod
+from functools import partial
+from dataclasses import dataclass
+from typing import (
+    AsyncIterator,
+    Callable,
+    ContextManager,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+import tinvest
+from loguru import logger
+from sqlalchemy.orm.session import Session
+from tinvest.schemas import CandleResolution
+
+from api.src import bands, database, schemas, tinkoff, utils
+from api.src.cache import MarketDataCache
+from api.src.config import settings
+from api.src.cooldown import AlertCooldowns, undo_alert
+from api.src.delivery import DeliveryQueue
+from api.src.unit_of_work import UnitOfWork
+
+
+@dataclass
+class PriceTick:
+    figi: str
+    price: float
+
+
+class PriceFeed(ABC):
+    """
+    Source of price updates for subscribed instruments.
+    """
+
+    @abstractmethod
+    async def subscribe(self, figi: str) -> None:
+        pass
+
+    @abstractmethod
+    async def unsubscribe(self, figi: str) -> None:
+        pass
+
+    @abstractmethod
+    def ticks(self) -> AsyncIterator[PriceTick]:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+class TinkoffPriceFeed(PriceFeed):
+    """
+    Minute candles from the Tinkoff streaming API, the close price of every
+    candle update is used as the current price.
+    Set TINKOFF_STREAMING_URL to point it to a local websocket.
+    """
+
+    def __init__(self, token: str, url: str = settings.TINKOFF_STREAMING_URL):
+        self.token = token
+        self.url = url
+        self._streaming = None
+
+    async def _get_streaming(self) -> tinvest.Streaming:
+        if self._streaming is None:
+            self._streaming = tinvest.Streaming(self.token)
+            if self.url:
+                self._streaming._api = self.url
+            await self._streaming.start()
+        return self._streaming
+
+    async def subscribe(self, figi: str) -> None:
+        streaming = await self._get_streaming()
+        await streaming.candle.subscribe(figi, CandleResolution.min1)
+
+    async def unsubscribe(self, figi: str) -> None:
+        streaming = await self._get_streaming()
+        await streaming.candle.unsubscribe(figi, CandleResolution.min1)
+
+    async def ticks(self) -> AsyncIterator[PriceTick]:
+        streaming = await self._get_streaming()
+        async for event in streaming:
+            if isinstance(event, tinvest.CandleStreamingResponse):
+                yield PriceTick(event.payload.figi, float(event.payload.c))
+
+    async def close(self) -> None:
+        if self._streaming is not None:
+            await self._streaming.stop()
+
+
+class QueuePriceFeed(PriceFeed):
+    """
+    In-process feed, prices are pushed with publish().
+    Ticks of instruments without subscription are dropped.
+    """
+
+    def __init__(self):
+        self.subscriptions: Set[str] = set()
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    async def subscribe(self, figi: str) -> None:
+        self.subscriptions.add(figi)
+
+    async def unsubscribe(self, figi: str) -> None:
+        self.subscriptions.discard(figi)
+
+    def publish(self, figi: str, price: float) -> None:
+        self._queue.put_nowait(PriceTick(figi, price))
+
+    async def ticks(self) -> AsyncIterator[PriceTick]:
+        while True:
+            tick = await self._queue.get()
+            if tick is None:
+                return
+            if tick.figi in self.subscriptions:
+                yield tick
+
+    async def close(self) -> None:
+        self._queue.put_nowait(None)
+
+
+Portfolio = Tuple[List[schemas.PortfolioPosition], Dict[str, str]]
+
+
+def fetch_portfolio(user: schemas.User, cache: MarketDataCache) -> Portfolio:
+    """
+    Return positions of a user and FIGI of every held ticker.
+    """
+    response = tinkoff.get_user_portfolio(user)
+    figis = {}
+    markets = tinkoff.get_portfolio_markets_from_response(response)
+    for symbols in markets.values():
+        figis.update(dict(symbols))
+    return tinkoff.get_portfolio_positions(user, response, cache), figis
+
+
+class StreamingEvaluator:
+    """
+    Subscribe to prices of the union of held tickers and evaluate only the
+    triggers of the ticker that just ticked, using the price band index.
+    Portfolios and triggers are reloaded every `refresh_interval` seconds
+    and subscriptions follow them. Triggers created or deleted in the bot are
+    picked up within `triggers_poll_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        feed: PriceFeed,
+        delivery: DeliveryQueue,
+        index: bands.BandIndex = None,
+        fetch: Callable[[schemas.User, MarketDataCache], Portfolio] = fetch_portfolio,
+        session_factory: Callable[
+            [], ContextManager[Session]
+        ] = database.get_db_session,
+        refresh_interval: float = settings.STREAMING_REFRESH_INTERVAL,
+        triggers_poll_interval: float = settings.STREAMING_TRIGGERS_POLL_INTERVAL,
+    ):
+        self.feed = feed
+        self.delivery = delivery
+        self.index = bands.BandIndex() if index is None else index
+        self.fetch = fetch
+        self.session_factory = session_factory
+        self.refresh_interval = refresh_interval
+        self.triggers_poll_interval = triggers_poll_interval
+        self.ticks = 0
+        self.alerts = 0
+        self.cache = MarketDataCache(settings.MARKET_CACHE_TTL)
+        self.cooldowns = None
+        self._users: Dict[int, schemas.User] = {}
+        self._tickers: Dict[str, str] = {}  # FIGI -> ticker
+        self._triggers_version: Optional[tuple] = None
+
+    async def refresh(self) -> None:
+        """
+        Reload users, triggers and positions, then update subscriptions.
+        """
+        loop = asyncio.get_event_loop()
+        self.cache.clear_prices()
+        with self.session_factory() as session:
+            self._triggers_version = utils.get_triggers_version(session)
+            users = utils.get_users(session)
+            triggers = {u.id: utils.get_user_triggers(u.id, session) for u in users}
+            if self.cooldowns is None:
+                self.cooldowns = AlertCooldowns.load(session)
+        tickers = {}
+        for user in users:
+            try:
+                positions, figis = await loop.run_in_executor(
+                    None, self.fetch, user, self.cache
+                )
+            except Exception as e:
+                logger.error(f"Positions of user {user.id} not refreshed: {e!r}")
+                positions = self.index.get_positions(user.id)
+                figis = {t: f for f, t in self._tickers.items()}
+            self.index.set_user(user.id, triggers[user.id], positions)
+            held = {p.ticker for p in positions}
+            tickers.update({f: t for t, f in figis.items() if t in held})
+        for figi in set(self._tickers) - set(tickers):
+            await self.feed.unsubscribe(figi)
+        for figi in set(tickers) - set(self._tickers):
+            await self.feed.subscribe(figi)
+        self._users = {u.id: u for u in users}
+        self._tickers = tickers
+        logger.info(f"Streaming {len(tickers)} instruments for {len(users)} users")
+
+    def reload_triggers(self) -> bool:
+        """
+        Apply triggers created or deleted since the last load to the index.
+        Return whether there were any.
+        """
+        with self.session_factory() as session:
+            version = utils.get_triggers_version(session)
+            if version == self._triggers_version:
+                return False
+            since = self._triggers_version[2] if self._triggers_version else None
+            ids = utils.get_trigger_ids(session)
+            changed = utils.get_triggers_updated_since(since, session)
+        removed = self.index.get_trigger_ids() - ids
+        for trigger_id in removed:
+            self.index.remove_trigger(trigger_id)
+        added = [t for t in changed if t.user_id in self._users]
+        for trigger in added:
+            self.index.add_trigger(trigger)
+        self._triggers_version = version
+        logger.info(f"Triggers reloaded: {len(added)} added, {len(removed)} removed")
+        return True
+
+    def on_tick(self, tick: PriceTick) -> int:
+        """
+        Evaluate triggers of the ticked instrument, return number of alerts sent.
+        """
+        self.ticks += 1
+        ticker = self._tickers.get(tick.figi)
+        if ticker is None:
+            return 0
+        fired = [
+            band
+            for band in self.index.fired(ticker, tick.price)
+            if not self.cooldowns.should_ignore(band.trigger, ticker)
+        ]
+        if not fired:
+            return 0
+        created = []
+        with self.session_factory() as session:
+            unit_of_work = UnitOfWork(session)
+            for band in fired:
+                user = self._users[band.trigger.user_id]
+                created_at = unit_of_work.add_alert(user, band.trigger, ticker)
+                self.cooldowns.record(band.trigger.id, ticker, created_at)
+                created.append(created_at)
+            unit_of_work.flush()
+        for band, created_at in zip(fired, created):
+            user = self._users[band.trigger.user_id]
+            undo = partial(
+                undo_alert,
+                self.cooldowns,
+                band.trigger.id,
+                ticker,
+                created_at,
+                self.session_factory,
+            )
+            text = utils.get_alert_text(band.trigger, band.position)
+            self.delivery.put(user.chat_id, text, on_failure=undo)
+        self.alerts += len(fired)
+        return len(fired)
+
+    async def run(self) -> None:
+        await self.refresh()
+        refresher = asyncio.ensure_future(self._refresh_periodically())
+        watcher = asyncio.ensure_future(self._watch_triggers())
+        try:
+            await self.run_ticks()
+        finally:
+            refresher.cancel()
+            watcher.cancel()
+
+    async def run_ticks(self) -> None:
+        """
+        Evaluate ticks until the feed is closed.
+        """
+        async for tick in self.feed.ticks():
+            self.on_tick(tick)
+
+    async def _refresh_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Refresh failed")
+
+    async def _watch_triggers(self) -> None:
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(self.triggers_poll_interval)
+            try:
+                await loop.run_in_executor(None, self.reload_triggers)
+            except Exception:
+                logger.exception("Triggers reload failed")
+
+
+async def main(feed: PriceFeed = None) -> None:
+    """
+    Evaluate triggers on every price update until the feed is closed.
+    """
+    if feed is None:
+        token = settings.TINKOFF_STREAMING_TOKEN
+        if not token:
+            with database.get_db_session() as session:
+                users = utils.get_users(session)
+            if not users:
+                logger.error("No users to stream with, set TINKOFF_STREAMING_TOKEN")
+                return
+            token = users[0].token
+        feed = TinkoffPriceFeed(token)
+    with DeliveryQueue() as delivery:
+        evaluator = StreamingEvaluator(feed, delivery, bands.get_band_index())
+        try:
+            await evaluator.run()
+        finally:
+            await feed.close()
@@ -1,34 +1,74 @@
 import sys
 import json
+import argparse
 import datetime
-from typing import List, Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Dict, Tuple, Optional
 
 import tinvest
 import requests
 from tinvest.schemas import CandleResolution
 
-from api.src import schemas, database
+from api.src import schemas, database, profiling
+from api.src.cache import MarketDataCache
+from api.src.config import settings
+from api.src.metrics import metrics
+from api.src.transport import get_transport
 
 
-def create_market_values_from_response(
-    response: requests.Response, symbol_prices: Dict[str, Dict[CandleResolution, float]]
+class MissingPricesError(Exception):
+    """
+    Upstream returned no current price for some of the held tickers.
+    """
+
+    def __init__(self, tickers: List[str]):
+        super().__init__(f"No market value for {', '.join(tickers)}")
+        self.tickers = tickers
+
+
+def get_current_prices_from_response(response: requests.Response) -> Dict[str, float]:
+    """
+    Example:
+    >>> get_current_prices_from_response(response)
+    {'GAZP': 227.61, 'SBER': 270.1, ...}
+    """
+    return get_current_prices_from_text(response.text)
+
+
+def get_current_prices_from_text(text: str) -> Dict[str, float]:
+    content = json.loads(text)
+    return {
+        value["symbol"]["ticker"]: value["price"]["value"]
+        for value in content["payload"]["values"]
+    }
+
+
+def create_market_values(
+    current_prices: Dict[str, float], symbol_prices: Dict[str, Dict[str, float]]
 ) -> List[schemas.MarketValue]:
-    content = json.loads(response.text)
     market_values = []
-    for value in content["payload"]["values"]:
-        candle_prices = symbol_prices[value["symbol"]["ticker"]]
+    for ticker, current_price in current_prices.items():
+        candle_prices = symbol_prices[ticker]
         market_values.append(
             schemas.MarketValue(
-                ticker=value["symbol"]["ticker"],
-                current_price=value["price"]["value"],
-                candle_1d_price=candle_prices[CandleResolution.day],
-                candle_1w_price=candle_prices[CandleResolution.week],
-                candle_1m_price=candle_prices[CandleResolution.month],
+                ticker=ticker,
+                current_price=current_price,
+                candle_1d_price=candle_prices["CANDLE_1D"],
+                candle_1w_price=candle_prices["CANDLE_1W"],
+                candle_1m_price=candle_prices["CANDLE_1M"],
+                candle_prices=candle_prices,
             )
         )
     return market_values
 
 
+def create_market_values_from_response(
+    response: requests.Response, symbol_prices: Dict[str, Dict[str, float]]
+) -> List[schemas.MarketValue]:
+    current_prices = get_current_prices_from_response(response)
+    return create_market_values(current_prices, symbol_prices)
+
+
 def get_portfolio_markets_from_response(
     response: tinvest.schemas.PortfolioResponse,
 ) -> Dict[tinvest.schemas.InstrumentType, Tuple[str, str]]:
@@ -52,89 +92,242 @@ def get_portfolio_positions_from_response(
     response: tinvest.schemas.PortfolioResponse,
     market_values: List[schemas.MarketValue],
 ) -> List[schemas.PortfolioPosition]:
+    """
+    Raise MissingPricesError if any held ticker has no market value, positions
+    of a partial portfolio would look like sold ones and lose their triggers.
+    """
     portfolio_positions = []
+    values_by_ticker = {m.ticker: m for m in market_values}
+    missing_tickers = []
     for position in response.payload.positions:
         # This probably corresponds to remaining USD balance on account
         if position.ticker == "USD000UTSTOM":
             continue
-        market_value = next(m for m in market_values if m.ticker == position.ticker)
+        market_value = values_by_ticker.get(position.ticker)
+        if market_value is None:
+            missing_tickers.append(position.ticker)
+            continue
         portfolio_positions.append(
-            schemas.PortfolioPosition(
-                name=position.name,
-                ticker=position.ticker,
-                candle_prices={
-                    "CANDLE_1D": market_value.candle_1d_price,
-                    "CANDLE_1W": market_value.candle_1w_price,
-                    "CANDLE_1M": market_value.candle_1m_price,
-                },
-                portfolio_price=float(position.average_position_price.value),
-                current_price=market_value.current_price,
+            schemas.PortfolioPosition.from_market_value(
+                position.name,
+                market_value,
+                float(position.average_position_price.value),
             )
         )
+    if missing_tickers:
+        raise MissingPricesError(missing_tickers)
     return portfolio_positions
 
 
+# Reference windows computed from a single daily-candle request per instrument,
+# each maps current time to the start of the window
+CANDLE_WINDOWS: Dict[str, Callable[[datetime.datetime], datetime.datetime]] = {
+    "CANDLE_1D": lambda now: now - datetime.timedelta(days=1),
+    "CANDLE_1W": lambda now: now - datetime.timedelta(days=7),
+    "CANDLE_1M": lambda now: now - datetime.timedelta(days=30),
+}
+
+
+def register_candle_window(
+    name: str, start: Callable[[datetime.datetime], datetime.datetime]
+) -> None:
+    """
+    Add a reference window served from the same candle request.
+    Example:
+    >>> register_candle_window("CANDLE_YTD", lambda now: now.replace(month=1, day=1))
+    """
+    CANDLE_WINDOWS[name] = start
+
+
 def get_avg_prices_from_candles(
     client: tinvest.SyncClient, figi: str
-) -> Dict[CandleResolution, float]:
-
-    prices = {}
-    now = datetime.datetime.now()
-    periods = [
-        [now - datetime.timedelta(days=1), now, CandleResolution.day],
-        [now - datetime.timedelta(days=7), now, CandleResolution.week],
-        [now - datetime.timedelta(days=30), now, CandleResolution.month],
-    ]
-    for period in periods:
+) -> Dict[str, float]:
+    """
+    Return average price of the first daily candle of every window in
+    CANDLE_WINDOWS, fetched with one request covering the longest window.
+    Example:
+    >>> get_avg_prices_from_candles(client, "BBG004730RP0")
+    {'CANDLE_1D': 227.61, 'CANDLE_1W': 225.1, 'CANDLE_1M': 219.32}
+    """
+    now = datetime.datetime.now().astimezone()
+    starts = get_candle_window_starts(now)
+    with metrics.upstream("candles"):
         response = client.get_market_candles(
-            figi, period[0], period[1], CandleResolution.day
+            figi, min(starts.values()), now, CandleResolution.day
         )
-        h = float(response.payload.candles[0].h)
-        l = float(response.payload.candles[0].l)
-        avg = round((h + l) / 2, 2)
-        prices[period[2]] = avg
+    return get_avg_prices_from_candles_response(response, starts)
+
+
+def get_candle_window_starts(now: datetime.datetime) -> Dict[str, datetime.datetime]:
+    return {name: start(now) for name, start in CANDLE_WINDOWS.items()}
+
+
+def get_avg_prices_from_candles_response(
+    response: tinvest.schemas.CandlesResponse, starts: Dict[str, datetime.datetime]
+) -> Dict[str, float]:
+    candles = sorted(response.payload.candles, key=lambda c: c.time)
+    prices = {}
+    for name, start in starts.items():
+        # Use the latest candle when nothing was traded inside the window
+        candle = next((c for c in candles if c.time >= start), candles[-1])
+        h = float(candle.h)
+        l = float(candle.l)
+        prices[name] = round((h + l) / 2, 2)
     return prices
 
 
 def get_market_values(
     client: tinvest.SyncClient,
     markets: Dict[tinvest.schemas.InstrumentType, Tuple[str, str]],
+    cache: Optional[MarketDataCache] = None,
+    fetch_prices: bool = True,
 ) -> List[schemas.MarketValue]:
+    """
+    Return current and candle prices for the given markets.
+    Only instruments missing from the cache are requested from upstream.
+    Without `fetch_prices` current prices are taken from the cache only,
+    for sweeps that already called prefetch_current_prices.
+    """
+    if cache is None:
+        cache = MarketDataCache(settings.MARKET_CACHE_TTL)
     market_values = []
     for instrument_type, symbols in markets.items():
         symbol_prices = {}
-        for symbol in symbols:
-            prices = get_avg_prices_from_candles(client, symbol[1])
-            symbol_prices[symbol[0]] = prices
-        url = "https://www.tinkoff.ru/api/trading/stocks/list"
-        if instrument_type == tinvest.schemas.InstrumentType.etf:
-            url = "https://www.tinkoff.ru/api/trading/etfs/list"
-        if instrument_type == tinvest.schemas.InstrumentType.currency:
-            url = "https://www.tinkoff.ru/api/trading/currency/list"
-        headers = {"content-type": "application/json"}
-        tickers = [s[0] for s in symbols]
-        payload = {
-            "tickers": tickers,
-            "start": 0,
-            "end": 100,
-            "sortType": "ByName",
-            "orderType": "Asc",
-            "country": "All",
-        }
-        r = requests.post(url, headers=headers, json=payload)
-        market_values.extend(create_market_values_from_response(r, symbol_prices))
+        for ticker, figi in symbols:
+            prices = cache.get_candle_prices(figi, CANDLE_WINDOWS)
+            if prices is None:
+                prices = get_avg_prices_from_candles(client, figi)
+                cache.set_candle_prices(figi, prices)
+            symbol_prices[ticker] = prices
+        current_prices = {}
+        missing_tickers = []
+        for ticker, _ in symbols:
+            price = cache.get_price(ticker)
+            if price is None:
+                missing_tickers.append(ticker)
+            else:
+                current_prices[ticker] = price
+        if missing_tickers and fetch_prices:
+            prices = get_current_prices(instrument_type, missing_tickers)
+            for ticker, price in prices.items():
+                cache.set_price(ticker, price)
+                current_prices[ticker] = price
+        market_values.extend(create_market_values(current_prices, symbol_prices))
     return market_values
 
 
-def get_user_positions(user: schemas.User) -> List[schemas.PortfolioPosition]:
+def get_current_prices(
+    instrument_type: tinvest.schemas.InstrumentType, tickers: List[str]
+) -> Dict[str, float]:
+    """
+    Request current prices split into chunks of MARKET_LIST_CHUNK_SIZE tickers,
+    fetched concurrently and merged.
+    """
+    chunks = split_tickers(tickers)
+    if len(chunks) == 1:
+        response = post_market_list(instrument_type, tickers)
+        return get_current_prices_from_response(response)
+    prices = {}
+    workers = min(settings.MARKET_LIST_WORKERS, len(chunks))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        responses = executor.map(lambda c: post_market_list(instrument_type, c), chunks)
+        for response in responses:
+            prices.update(get_current_prices_from_response(response))
+    return prices
+
+
+def prefetch_current_prices(
+    responses: List[tinvest.schemas.PortfolioResponse], cache: MarketDataCache
+) -> None:
+    """
+    Fill the cache with current prices of all tickers held in the given
+    portfolios using as few requests as possible.
+    """
+    tickers = {}
+    for response in responses:
+        markets = get_portfolio_markets_from_response(response)
+        for instrument_type, symbols in markets.items():
+            tickers.setdefault(instrument_type, set()).update(s[0] for s in symbols)
+    for instrument_type, symbols in tickers.items():
+        missing_tickers = sorted(t for t in symbols if cache.get_price(t) is None)
+        if missing_tickers:
+            prices = get_current_prices(instrument_type, missing_tickers)
+            for ticker, price in prices.items():
+                cache.set_price(ticker, price)
+
+
+def split_tickers(tickers: List[str]) -> List[List[str]]:
+    chunks = []
+    for start in range(0, len(tickers), settings.MARKET_LIST_CHUNK_SIZE):
+        end = start + settings.MARKET_LIST_CHUNK_SIZE
+        chunks.append(tickers[start:end])
+    return chunks or [[]]
+
+
+def post_market_list(
+    instrument_type: tinvest.schemas.InstrumentType, tickers: List[str]
+) -> requests.Response:
+    """
+    Request current prices for the given tickers of one instrument type.
+    """
+    url = get_market_list_url(instrument_type)
+    payload = get_market_list_payload(tickers)
+    with metrics.upstream("market_list"):
+        return get_transport().post(url, headers=MARKET_LIST_HEADERS, json=payload)
+
+
+MARKET_LIST_HEADERS = {"content-type": "application/json"}
+
+
+def get_market_list_url(instrument_type: tinvest.schemas.InstrumentType) -> str:
+    url = f"{settings.TINKOFF_TRADING_URL}/stocks/list"
+    if instrument_type == tinvest.schemas.InstrumentType.etf:
+        url = f"{settings.TINKOFF_TRADING_URL}/etfs/list"
+    if instrument_type == tinvest.schemas.InstrumentType.currency:
+        url = f"{settings.TINKOFF_TRADING_URL}/currency/list"
+    return url
+
+
+def get_market_list_payload(tickers: List[str]) -> dict:
+    return {
+        "tickers": tickers,
+        "start": 0,
+        "end": len(tickers),
+        "sortType": "ByName",
+        "orderType": "Asc",
+        "country": "All",
+    }
+
+
+def get_user_positions(
+    user: schemas.User, cache: Optional[MarketDataCache] = None
+) -> List[schemas.PortfolioPosition]:
     """
     Return positions for a given user together with current market price
     and candle prices for the past day, week and month.
+    Pass the same `cache` for every user of a sweep to share market data.
+    """
+    response = get_user_portfolio(user)
+    return get_portfolio_positions(user, response, cache)
+
+
+def get_user_portfolio(user: schemas.User) -> tinvest.schemas.PortfolioResponse:
+    with metrics.upstream("portfolio"):
+        return get_transport().get_client(user.token).get_portfolio()
+
+
+def get_portfolio_positions(
+    user: schemas.User,
+    response: tinvest.schemas.PortfolioResponse,
+    cache: Optional[MarketDataCache] = None,
+    fetch_prices: bool = True,
+) -> List[schemas.PortfolioPosition]:
+    """
+    Return positions of an already fetched portfolio with market prices.
     """
-    client = tinvest.SyncClient(user.token)
-    response = client.get_portfolio()
+    client = get_transport().get_client(user.token)
     portfolio_markets = get_portfolio_markets_from_response(response)
-    market_values = get_market_values(client, portfolio_markets)
+    market_values = get_market_values(client, portfolio_markets, cache, fetch_prices)
     portfolio_positions = get_portfolio_positions_from_response(response, market_values)
     return portfolio_positions
 
@@ -153,9 +346,14 @@ def main(user_id: int) -> None:
         return positions
 
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Print positions of a user")
+    parser.add_argument("user_id", type=int)
+    profiling.add_arguments(parser)
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    if len(sys.argv) == 1:
-        print("user id in required")
-        sys.exit(0)
-    user_id = sys.argv[1]
-    main(int(user_id))
+    args = parse_args()
+    with profiling.profile_if_requested("tinkoff", args):
+        main(args.user_id)
@@ -0,0 +1,183 @@
+"""
+Asyncio counterparts of the Tinkoff requests used by the trigger sweep.
+"""
+import asyncio
+import datetime
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import aiohttp
+import tinvest
+from tinvest.schemas import CandleResolution
+
+from api.src import schemas, tinkoff
+from api.src.cache import MarketDataCache
+from api.src.config import settings
+from api.src.metrics import metrics
+
+
+class RequestLimiter:
+    """
+    Bound the number of concurrent upstream requests, both in total
+    and per TinkoffAPI token.
+    """
+
+    def __init__(self, total: int, per_token: int):
+        self.per_token = per_token
+        self._total = asyncio.Semaphore(total)
+        self._tokens: Dict[str, asyncio.Semaphore] = {}
+
+    @asynccontextmanager
+    async def acquire(self, token: Optional[str] = None) -> AsyncIterator[None]:
+        if token is None:
+            async with self._total:
+                yield
+            return
+        if token not in self._tokens:
+            self._tokens[token] = asyncio.Semaphore(self.per_token)
+        async with self._tokens[token], self._total:
+            yield
+
+
+class MarketDataFetcher:
+    """
+    Fill a MarketDataCache concurrently for many users.
+    Concurrent requests for the same instrument share one upstream call.
+    """
+
+    def __init__(
+        self,
+        http: aiohttp.ClientSession,
+        cache: MarketDataCache,
+        limiter: RequestLimiter,
+    ):
+        self.http = http
+        self.cache = cache
+        self.limiter = limiter
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+
+    async def get_avg_prices_from_candles(
+        self, client: tinvest.AsyncClient, token: str, figi: str
+    ) -> Dict[str, float]:
+        prices = self.cache.get_candle_prices(figi, tinkoff.CANDLE_WINDOWS)
+        if prices is not None:
+            return prices
+        key = ("candle", figi)
+        if key not in self._inflight:
+            self._track([key], self._fetch_candles(client, token, figi))
+        return await asyncio.shield(self._inflight[key])
+
+    async def get_current_prices(
+        self, instrument_type: tinvest.schemas.InstrumentType, tickers: List[str]
+    ) -> Dict[str, float]:
+        current_prices = {}
+        missing_tickers = []
+        for ticker in tickers:
+            price = self.cache.get_price(ticker)
+            if price is not None:
+                current_prices[ticker] = price
+            elif ("price", ticker) not in self._inflight:
+                missing_tickers.append(ticker)
+        if missing_tickers:
+            keys = [("price", ticker) for ticker in missing_tickers]
+            self._track(keys, self._fetch_prices(instrument_type, missing_tickers))
+        pending = {
+            self._inflight[("price", t)]
+            for t in tickers
+            if t not in current_prices and ("price", t) in self._inflight
+        }
+        for prices in await asyncio.gather(*[asyncio.shield(f) for f in pending]):
+            current_prices.update({t: p for t, p in prices.items() if t in tickers})
+        return current_prices
+
+    def _track(self, keys: List[tuple], coroutine) -> None:
+        future = asyncio.ensure_future(coroutine)
+        for key in keys:
+            self._inflight[key] = future
+
+        def untrack(_: asyncio.Future) -> None:
+            for key in keys:
+                self._inflight.pop(key, None)
+
+        future.add_done_callback(untrack)
+
+    async def _fetch_candles(
+        self, client: tinvest.AsyncClient, token: str, figi: str
+    ) -> Dict[str, float]:
+        now = datetime.datetime.now().astimezone()
+        starts = tinkoff.get_candle_window_starts(now)
+        async with self.limiter.acquire(token):
+            with metrics.upstream("candles"):
+                response = await client.get_market_candles(
+                    figi, min(starts.values()), now, CandleResolution.day
+                )
+        prices = tinkoff.get_avg_prices_from_candles_response(response, starts)
+        self.cache.set_candle_prices(figi, prices)
+        return prices
+
+    async def _fetch_prices(
+        self, instrument_type: tinvest.schemas.InstrumentType, tickers: List[str]
+    ) -> Dict[str, float]:
+        prices = {}
+        chunks = tinkoff.split_tickers(tickers)
+        for chunk_prices in await asyncio.gather(
+            *[self._fetch_prices_chunk(instrument_type, chunk) for chunk in chunks]
+        ):
+            prices.update(chunk_prices)
+        for ticker, price in prices.items():
+            self.cache.set_price(ticker, price)
+        return prices
+
+    async def _fetch_prices_chunk(
+        self, instrument_type: tinvest.schemas.InstrumentType, tickers: List[str]
+    ) -> Dict[str, float]:
+        url = tinkoff.get_market_list_url(instrument_type)
+        payload = tinkoff.get_market_list_payload(tickers)
+        async with self.limiter.acquire():
+            with metrics.upstream("market_list"):
+                async with self.http.post(
+                    url, headers=tinkoff.MARKET_LIST_HEADERS, json=payload
+                ) as response:
+                    text = await response.text()
+        return tinkoff.get_current_prices_from_text(text)
+
+
+async def get_market_values(
+    client: tinvest.AsyncClient,
+    token: str,
+    markets: Dict[tinvest.schemas.InstrumentType, List[Tuple[str, str]]],
+    fetcher: MarketDataFetcher,
+) -> List[schemas.MarketValue]:
+    market_values = []
+    for instrument_type, symbols in markets.items():
+        candle_prices = await asyncio.gather(
+            *[
+                fetcher.get_avg_prices_from_candles(client, token, figi)
+                for _, figi in symbols
+            ]
+        )
+        symbol_prices = {s[0]: prices for s, prices in zip(symbols, candle_prices)}
+        tickers = [s[0] for s in symbols]
+        current_prices = await fetcher.get_current_prices(instrument_type, tickers)
+        market_values.extend(
+            tinkoff.create_market_values(current_prices, symbol_prices)
+        )
+    return market_values
+
+
+async def get_user_positions(
+    user: schemas.User, fetcher: MarketDataFetcher
+) -> List[schemas.PortfolioPosition]:
+    """
+    Same as tinkoff.get_user_positions but without blocking the event loop.
+    """
+    client = tinvest.AsyncClient(user.token, session=fetcher.http)
+    client._base_url = settings.TINKOFF_API_URL
+    async with fetcher.limiter.acquire(user.token):
+        with metrics.upstream("portfolio"):
+            response = await client.get_portfolio()
+    portfolio_markets = tinkoff.get_portfolio_markets_from_response(response)
+    market_values = await get_market_values(
+        client, user.token, portfolio_markets, fetcher
+    )
+    return tinkoff.get_portfolio_positions_from_response(response, market_values)
@@ -0,0 +1,269 @@
+"""
+Local stand-in for the Tinkoff endpoints used by the bot and the sweep.
+
+Serves portfolios, daily candles and trading list prices generated from
+a deterministic random walk, with configurable latency, errors and 429s.
+Point TINKOFF_API_URL to http://HOST:PORT/openapi and TINKOFF_TRADING_URL
+to http://HOST:PORT/api/trading to use it.
+"""
+import math
+import random
+import asyncio
+import argparse
+import datetime
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+INSTRUMENT_TYPES = {"stocks": "Stock", "etfs": "Etf", "currency": "Currency"}
+
+
+class RandomWalk:
+    """
+    Price of every ticker moves by a random step every `tick` seconds.
+    Steps before the start are generated backwards, so the same seed always
+    gives the same prices for the same number of ticks since the start.
+    """
+
+    def __init__(
+        self,
+        seed: int = 0,
+        volatility: float = 0.002,
+        tick: float = 60,
+        start: Optional[datetime.datetime] = None,
+    ):
+        self.seed = seed
+        self.volatility = volatility
+        self.tick = tick
+        self.start = start or datetime.datetime.now(datetime.timezone.utc)
+        self._lock = threading.Lock()
+        self._walks: Dict[Tuple[str, int], Tuple[List[float], random.Random]] = {}
+
+    def get_base_price(self, ticker: str) -> float:
+        return round(random.Random(f"{self.seed}:{ticker}").uniform(10, 1000), 2)
+
+    def get_step(self, moment: datetime.datetime) -> int:
+        return math.floor((moment - self.start).total_seconds() / self.tick)
+
+    def get_price(self, ticker: str, step: int) -> float:
+        direction = 1 if step >= 0 else -1
+        with self._lock:
+            entry = self._walks.get((ticker, direction))
+            if entry is None:
+                rng = random.Random(f"{self.seed}:{ticker}:{direction}")
+                entry = self._walks[(ticker, direction)] = (
+                    [self.get_base_price(ticker)],
+                    rng,
+                )
+            walk, rng = entry
+            while len(walk) <= abs(step):
+                walk.append(walk[-1] * math.exp(rng.gauss(0, self.volatility)))
+            return round(walk[abs(step)], 4)
+
+    def get_current_price(self, ticker: str) -> float:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return self.get_price(ticker, self.get_step(now))
+
+
+class StandInMarket:
+    """
+    Generated portfolios: every token holds `positions` of `tickers` markets.
+    """
+
+    def __init__(self, walk: RandomWalk, tickers: int = 200, positions: int = 10):
+        self.walk = walk
+        self.tickers = [f"T{i:04d}" for i in range(tickers)]
+        self.positions = min(positions, tickers)
+        self.stats = {"requests": 0, "errors": 0, "throttled": 0}
+
+    def get_portfolio(self, token: str) -> List[dict]:
+        rng = random.Random(f"{self.walk.seed}:{token}")
+        positions = []
+        for ticker in rng.sample(self.tickers, self.positions):
+            lots = rng.randint(1, 100)
+            average_price = self.walk.get_base_price(ticker) * rng.uniform(0.7, 1.3)
+            positions.append(
+                {
+                    "name": f"Company {ticker}",
+                    "ticker": ticker,
+                    "figi": f"FIGI-{ticker}",
+                    "instrumentType": "Stock",
+                    "balance": lots,
+                    "lots": lots,
+                    "averagePositionPrice": {
+                        "currency": "USD",
+                        "value": round(average_price, 2),
+                    },
+                }
+            )
+        return positions
+
+    def get_daily_candles(
+        self, figi: str, from_: datetime.datetime, to: datetime.datetime
+    ) -> List[dict]:
+        ticker = figi.replace("FIGI-", "")
+        steps_per_day = max(int(86400 / self.walk.tick), 1)
+        candles = []
+        day = from_.replace(hour=0, minute=0, second=0, microsecond=0)
+        while day < to:
+            first = self.walk.get_step(day)
+            step = max(steps_per_day // 24, 1)
+            prices = [
+                self.walk.get_price(ticker, s)
+                for s in range(first, first + steps_per_day, step)
+            ]
+            candles.append(
+                {
+                    "figi": figi,
+                    "interval": "day",
+                    "o": prices[0],
+                    "c": prices[-1],
+                    "h": max(prices),
+                    "l": min(prices),
+                    "v": 1000,
+                    "time": day.isoformat(),
+                }
+            )
+            day += datetime.timedelta(days=1)
+        return candles
+
+
+def create_app(
+    market: StandInMarket,
+    latency: float = 0.0,
+    error_rate: float = 0.0,
+    throttle_rate: float = 0.0,
+    seed: int = 0,
+) -> web.Application:
+    """
+    Every request waits `latency` seconds, then fails with 500 with
+    probability `error_rate` or with 429 with probability `throttle_rate`.
+    """
+    rng = random.Random(seed)
+    stats = market.stats
+
+    @web.middleware
+    async def imitate_upstream(request: web.Request, handler) -> web.Response:
+        stats["requests"] += 1
+        if latency:
+            await asyncio.sleep(latency)
+        roll = rng.random()
+        if roll < error_rate:
+            stats["errors"] += 1
+            return error_response(500, "Internal error")
+        if roll < error_rate + throttle_rate:
+            stats["throttled"] += 1
+            return error_response(429, "Too many requests")
+        return await handler(request)
+
+    async def portfolio(request: web.Request) -> web.Response:
+        token = request.headers.get("Authorization", "").replace("Bearer ", "")
+        return ok_response({"positions": market.get_portfolio(token)})
+
+    async def candles(request: web.Request) -> web.Response:
+        figi = request.query["figi"]
+        from_ = datetime.datetime.fromisoformat(request.query["from"])
+        to = datetime.datetime.fromisoformat(request.query["to"])
+        payload = {
+            "figi": figi,
+            "interval": request.query.get("interval", "day"),
+            "candles": market.get_daily_candles(figi, from_, to),
+        }
+        return ok_response(payload)
+
+    async def trading_list(request: web.Request) -> web.Response:
+        if request.match_info["instrument"] not in INSTRUMENT_TYPES:
+            raise web.HTTPNotFound()
+        body = await request.json()
+        values = [
+            {
+                "symbol": {"ticker": ticker},
+                "price": {"value": market.walk.get_current_price(ticker)},
+            }
+            for ticker in body["tickers"]
+        ]
+        return ok_response({"values": values, "total": len(values)})
+
+    async def get_stats(request: web.Request) -> web.Response:
+        return web.json_response(stats)
+
+    app = web.Application(middlewares=[imitate_upstream])
+    app.router.add_get("/openapi/portfolio", portfolio)
+    app.router.add_get("/openapi/market/candles", candles)
+    app.router.add_post("/api/trading/{instrument}/list", trading_list)
+    app.router.add_get("/stats", get_stats)
+    return app
+
+
+def ok_response(payload: dict) -> web.Response:
+    return web.json_response(
+        {"trackingId": "stand-in", "status": "Ok", "payload": payload}
+    )
+
+
+def error_response(status: int, message: str) -> web.Response:
+    body = {
+        "trackingId": "stand-in",
+        "status": "Error",
+        "payload": {"message": message},
+    }
+    return web.json_response(body, status=status)
+
+
+class StandInServer:
+    """
+    Runs the app in a background thread, used by tests and load scripts.
+    """
+
+    def __init__(self, app: web.Application, host: str = "127.0.0.1", port: int = 0):
+        self.app = app
+        self.host = host
+        self.port = port
+        self._loop = asyncio.new_event_loop()
+        self._runner = web.AppRunner(app)
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self) -> "StandInServer":
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+        return self
+
+    def stop(self) -> None:
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    async def _start(self) -> None:
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Local Tinkoff API stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tickers", type=int, default=200, help="Markets in total")
+    parser.add_argument("--positions", type=int, default=10, help="Per portfolio")
+    parser.add_argument("--tick", type=float, default=60, help="Seconds per price step")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    walk = RandomWalk(args.seed, tick=args.tick)
+    market = StandInMarket(walk, args.tickers, args.positions)
+    app = create_app(
+        market, args.latency, args.error_rate, args.throttle_rate, args.seed
+    )
+    web.run_app(app, host=args.host, port=args.port)
@@ -0,0 +1,124 @@
+"""
+Pooled HTTP transport for Tinkoff requests.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+import aiohttp
+import tinvest
+import requests
+from requests.adapters import HTTPAdapter
+
+from api.src.config import settings
+
+
+class TimeoutSession(requests.Session):
+    """
+    Session applying default (connect, read) timeouts to every request.
+    """
+
+    def __init__(self, timeout: Tuple[float, float]):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+class CountingAdapter(HTTPAdapter):
+    """
+    Keep-alive adapter counting requests sent and connections opened.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.requests = 0
+        self._lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def send(self, *args, **kwargs) -> requests.Response:
+        with self._lock:
+            self.requests += 1
+        return super().send(*args, **kwargs)
+
+    @property
+    def connections(self) -> int:
+        pools = self.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+
+class Transport:
+    """
+    One keep-alive session shared by plain requests and every tinvest client,
+    plus a bounded pool of clients reused across sweeps and bot requests.
+    """
+
+    def __init__(
+        self,
+        connect_timeout: float = settings.HTTP_CONNECT_TIMEOUT,
+        read_timeout: float = settings.HTTP_READ_TIMEOUT,
+        pool_size: int = settings.HTTP_POOL_SIZE,
+        max_clients: int = settings.TINKOFF_CLIENT_POOL_SIZE,
+    ):
+        self.max_clients = max_clients
+        self.adapter = CountingAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session = TimeoutSession((connect_timeout, read_timeout))
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self._lock = threading.Lock()
+        self._clients: "OrderedDict[str, tinvest.SyncClient]" = OrderedDict()
+
+    def get_client(self, token: str) -> tinvest.SyncClient:
+        with self._lock:
+            client = self._clients.pop(token, None)
+            if client is None:
+                client = tinvest.SyncClient(token, session=self.session)
+                client._base_url = settings.TINKOFF_API_URL
+            self._clients[token] = client
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+            return client
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.session.post(url, **kwargs)
+
+    def stats(self) -> dict:
+        requests_sent = self.adapter.requests
+        connections = self.adapter.connections
+        return {
+            "requests": requests_sent,
+            "connections": connections,
+            "reused": max(requests_sent - connections, 0),
+            "clients": len(self._clients),
+        }
+
+
+# One transport per process, forked workers must not share sockets
+_transports: Dict[int, Transport] = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport() -> Transport:
+    pid = os.getpid()
+    if pid not in _transports:
+        with _transports_lock:
+            if pid not in _transports:
+                _transports[pid] = Transport()
+    return _transports[pid]
+
+
+def create_async_session() -> aiohttp.ClientSession:
+    """
+    Keep-alive session for the async sweep, must be created inside the event loop.
+    """
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=settings.SWEEP_CONCURRENCY, limit_per_host=settings.HTTP_POOL_SIZE
+        ),
+        timeout=aiohttp.ClientTimeout(
+            sock_connect=settings.HTTP_CONNECT_TIMEOUT,
+            sock_read=settings.HTTP_READ_TIMEOUT,
+        ),
+    )
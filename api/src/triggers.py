@@ -1,36 +1,470 @@
-import sys
-from typing import Optional
+import signal
+import asyncio
+import argparse
+from functools import partial
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
 
-from api.src import utils, tinkoff, database
+import aiohttp
+import tinvest
+from loguru import logger
+from sqlalchemy.orm.session import Session
 
+from api.src import utils, tinkoff, tinkoff_async, database, schemas, evaluation
+from api.src import profiling, streaming
+from api.src.cache import MarketDataCache
+from api.src.cooldown import AlertCooldowns, undo_alert
+from api.src.delivery import DeliveryQueue
+from api.src.scheduler import Scheduler
+from api.src.metrics import (
+    ALERTS_FIRED,
+    SWEEPS,
+    export,
+    get_summary,
+    metrics,
+    start_http_server,
+)
+from api.src.unit_of_work import UnitOfWork
+from api.src.transport import create_async_session, get_transport
+from api.src.config import settings
 
-def main(user_id: Optional[int] = None) -> None:
+
+@dataclass
+class SweepResult:
+    users: int = 0
+    alerts: int = 0
+    skipped: int = 0
+
+    def __add__(self, other: "SweepResult") -> "SweepResult":
+        return SweepResult(
+            users=self.users + other.users,
+            alerts=self.alerts + other.alerts,
+            skipped=self.skipped + other.skipped,
+        )
+
+
+def shard_users(
+    users: List[schemas.User], shard: Optional[Tuple[int, int]]
+) -> List[schemas.User]:
+    """
+    Return users belonging to shard `(index, count)`.
+    Triggers and alerts belong to a single user, so shards never evaluate
+    the same trigger and alert deduplication holds across concurrent shards.
+    """
+    if shard is None:
+        return users
+    index, count = shard
+    return [u for u in users if u.id % count == index]
+
+
+def prepare_user(
+    user: schemas.User,
+    positions: List[schemas.PortfolioPosition],
+    unit_of_work: UnitOfWork,
+) -> List[schemas.Trigger]:
+    """
+    Schedule removal of triggers for markets the user no longer holds,
+    return the rest.
+    """
+    triggers = utils.get_user_triggers(user.id, unit_of_work.session)
+    unit_of_work.delete_triggers(user, utils.get_unused_tickers(triggers, positions))
+    portfolio_tickers = [p.ticker for p in positions]
+    return [t for t in triggers if (not t.ticker or t.ticker in portfolio_tickers)]
+
+
+def process_users(
+    users_positions: List[Tuple[schemas.User, List[schemas.PortfolioPosition]]],
+    session: Session,
+    cooldowns: Optional[AlertCooldowns] = None,
+    delivery: Optional[DeliveryQueue] = None,
+    gate: Optional[evaluation.ChangeGate] = None,
+) -> int:
+    """
+    Check triggers of users against fetched positions and send alerts if needed.
+    Triggers of all users are evaluated in one batch, alerts are handed over
+    to the delivery queue when given instead of being sent one by one.
+    With a gate, positions whose price cannot have crossed a band edge since
+    the previous sweep are left out.
+    Return number of alerts sent.
+    """
+    if cooldowns is None:
+        cooldowns = AlertCooldowns.load(session)
+    unit_of_work = UnitOfWork(session)
+    batch = evaluation.TriggerBatch()
+    for user, positions in users_positions:
+        triggers = prepare_user(user, positions, unit_of_work)
+        unit_of_work.save_positions(user, positions)
+        if gate is not None:
+            positions = gate.select(user.id, triggers, positions)
+            if not positions:
+                continue
+        batch.add(user, triggers, positions)
+    with metrics.stage("evaluation"):
+        fired = batch.evaluate()
+    with metrics.stage("should_ignore"):
+        fired = [
+            (user, trigger, position)
+            for user, trigger, position in fired
+            if not cooldowns.should_ignore(trigger, position.ticker)
+        ]
+    created = []
+    with metrics.stage("send"):
+        for user, trigger, position in fired:
+            if delivery is None:
+                utils.send_alert(user, trigger, position)
+            created_at = unit_of_work.add_alert(user, trigger, position.ticker)
+            cooldowns.record(trigger.id, position.ticker, created_at)
+            created.append(created_at)
+    with metrics.stage("save"):
+        unit_of_work.flush()
+    if delivery is not None:
+        # Alerts are saved first, so undoing a failed delivery finds them
+        for (user, trigger, position), created_at in zip(fired, created):
+            undo = partial(
+                undo_alert, cooldowns, trigger.id, position.ticker, created_at
+            )
+            text = utils.get_alert_text(trigger, position)
+            delivery.put(user.chat_id, text, on_failure=undo)
+    metrics.inc(ALERTS_FIRED, len(fired))
+    return len(fired)
+
+
+@dataclass
+class SweepState:
+    """
+    State reused between sweeps of a long-running process.
+    """
+
+    cache: MarketDataCache
+    delivery: DeliveryQueue
+    cooldowns: Optional[AlertCooldowns] = None
+    gate: evaluation.ChangeGate = field(default_factory=evaluation.ChangeGate)
+    # Keep-alive session of the async sweep, bound to the daemon's event loop
+    http: Optional[aiohttp.ClientSession] = None
+
+    @classmethod
+    def create(cls, shard: Optional[Tuple[int, int]] = None) -> "SweepState":
+        # Concurrent shards share the global Telegram rate limit
+        count = 1 if shard is None else shard[1]
+        return cls(
+            cache=MarketDataCache(settings.MARKET_CACHE_TTL),
+            delivery=DeliveryQueue(global_rate=settings.TELEGRAM_GLOBAL_RATE / count),
+        )
+
+    def get_cooldowns(self, session: Session) -> AlertCooldowns:
+        if self.cooldowns is None:
+            self.cooldowns = AlertCooldowns.load(session)
+        else:
+            self.cooldowns.purge()
+        return self.cooldowns
+
+    def close(self) -> None:
+        self.delivery.close()
+
+
+@contextmanager
+def sweep_state(
+    state: Optional[SweepState], shard: Optional[Tuple[int, int]]
+) -> Iterator[SweepState]:
+    """
+    Use the given state or create one for a single sweep.
+    """
+    if state is not None:
+        yield state
+        return
+    state = SweepState.create(shard)
+    try:
+        yield state
+    finally:
+        state.close()
+
+
+def main(
+    user_id: Optional[int] = None,
+    shard: Optional[Tuple[int, int]] = None,
+    state: Optional[SweepState] = None,
+) -> SweepResult:
     """
     Check user triggers and send alerts if needed.
     """
-    with database.get_db_session() as session:
-        users = utils.get_users(session)
+    sweep = SweepResult()
+    before = metrics.snapshot()
+    with sweep_state(state, shard) as state, database.get_db_session() as session:
+        state.cache.clear_prices()
+        users = shard_users(utils.get_users(session), shard)
         if user_id is not None:
             users = [u for u in users if u.id == user_id]
-        for user in users:
-            triggers = utils.get_user_triggers(user.id, session)
-            positions = tinkoff.get_user_positions(user)
-            utils.clean_unused_triggers(user, triggers, positions, session)
-            portfolio_tickers = [p.ticker for p in positions]
-            triggers = [
-                t for t in triggers if (not t.ticker or t.ticker in portfolio_tickers)
-            ]
-            for position in positions:
-                for t in triggers:
-                    if t.is_triggered(position) and not utils.should_ignore(
-                        t, position
-                    ):
-                        utils.send_alert(user, t, position)
-                        utils.save_alert(user, t, position.ticker, session)
+        with metrics.stage("portfolio"):
+            portfolios = get_users_portfolios(users)
+        with metrics.stage("prices"):
+            try:
+                tinkoff.prefetch_current_prices([p for _, p in portfolios], state.cache)
+            except Exception as e:
+                # Users whose prices are missing are skipped below
+                logger.error(f"Current prices not prefetched: {e!r}")
+        with metrics.stage("positions"):
+            users_positions = get_users_positions(portfolios, state.cache)
+        cooldowns = state.get_cooldowns(session)
+        sweep.alerts = process_users(
+            users_positions, session, cooldowns, state.delivery, state.gate
+        )
+        sweep.users = len(users_positions)
+        sweep.skipped = len(users) - len(users_positions)
+        logger.info(f"Market data cache: {state.cache.stats()}")
+        logger.info(f"Change gate: {state.gate.stats()}")
+    logger.info(f"HTTP transport: {get_transport().stats()}")
+    report_sweep(before, shard)
+    return sweep
+
+
+def get_users_portfolios(
+    users: List[schemas.User],
+) -> List[Tuple[schemas.User, tinvest.schemas.PortfolioResponse]]:
+    """
+    Return portfolios of users, users whose portfolio failed are skipped.
+    """
+    portfolios = []
+    for user in users:
+        try:
+            portfolios.append((user, tinkoff.get_user_portfolio(user)))
+        except Exception as e:
+            logger.error(f"User {user.id} skipped: {e!r}")
+    return portfolios
+
+
+def get_users_positions(
+    portfolios: List[Tuple[schemas.User, tinvest.schemas.PortfolioResponse]],
+    cache: MarketDataCache,
+) -> List[Tuple[schemas.User, List[schemas.PortfolioPosition]]]:
+    """
+    Return positions of users whose held tickers all got prices from
+    prefetch_current_prices and candles, the rest are skipped until
+    the next sweep.
+    """
+    users_positions = []
+    for user, portfolio in portfolios:
+        try:
+            positions = tinkoff.get_portfolio_positions(
+                user, portfolio, cache, fetch_prices=False
+            )
+        except tinkoff.MissingPricesError as e:
+            logger.warning(f"User {user.id} skipped: {e}")
+            continue
+        except Exception as e:
+            logger.error(f"User {user.id} skipped: {e!r}")
+            continue
+        users_positions.append((user, positions))
+    return users_positions
+
+
+def report_sweep(before: Dict[str, float], shard: Optional[Tuple[int, int]]) -> None:
+    """
+    Log metrics changed by the sweep and export all of them.
+    Shards only log theirs, the parent process merges and exports them.
+    """
+    if shard is None:
+        metrics.inc(SWEEPS)
+    summary = get_summary(before, metrics.snapshot())
+    logger.info(f"Sweep metrics: {summary}")
+    if shard is None:
+        export()
+
+
+@asynccontextmanager
+async def http_session(state: SweepState) -> AsyncIterator[aiohttp.ClientSession]:
+    """
+    Use the session kept by a long-running process or open one for a sweep.
+    """
+    if state.http is not None:
+        yield state.http
+        return
+    async with create_async_session() as http:
+        yield http
+
+
+async def main_async(
+    user_id: Optional[int] = None,
+    shard: Optional[Tuple[int, int]] = None,
+    state: Optional[SweepState] = None,
+) -> SweepResult:
+    """
+    Same as main but fetches positions of all users concurrently.
+    Up to SWEEP_CONCURRENCY users are fetched at once, every one of them gets
+    SWEEP_USER_DEADLINE seconds from the start, slow accounts are skipped.
+    """
+    sweep = SweepResult()
+    before = metrics.snapshot()
+    limiter = tinkoff_async.RequestLimiter(
+        settings.SWEEP_CONCURRENCY, settings.SWEEP_TOKEN_CONCURRENCY
+    )
+
+    # Users wait for a slot before their deadline starts, so a long queue
+    # is not mistaken for slow accounts
+    slots = asyncio.Semaphore(settings.SWEEP_CONCURRENCY)
+
+    async def fetch(user: schemas.User, fetcher: tinkoff_async.MarketDataFetcher):
+        try:
+            async with slots:
+                positions = await asyncio.wait_for(
+                    tinkoff_async.get_user_positions(user, fetcher),
+                    settings.SWEEP_USER_DEADLINE,
+                )
+        except asyncio.TimeoutError:
+            logger.warning(f"User {user.id} skipped: deadline exceeded")
+            return user, None
+        except Exception as e:
+            logger.error(f"User {user.id} skipped: {e!r}")
+            return user, None
+        return user, positions
+
+    with sweep_state(state, shard) as state, database.get_db_session() as session:
+        state.cache.clear_prices()
+        users = shard_users(utils.get_users(session), shard)
+        if user_id is not None:
+            users = [u for u in users if u.id == user_id]
+        async with http_session(state) as http:
+            fetcher = tinkoff_async.MarketDataFetcher(http, state.cache, limiter)
+            with metrics.stage("positions"):
+                results = await asyncio.gather(*[fetch(u, fetcher) for u in users])
+        users_positions = [(u, p) for u, p in results if p is not None]
+        cooldowns = state.get_cooldowns(session)
+        sweep.alerts = process_users(
+            users_positions, session, cooldowns, state.delivery, state.gate
+        )
+        sweep.users = len(users_positions)
+        sweep.skipped = len(results) - len(users_positions)
+        logger.info(f"Market data cache: {state.cache.stats()}")
+        logger.info(f"Change gate: {state.gate.stats()}")
+    report_sweep(before, shard)
+    return sweep
+
+
+async def open_http_session() -> aiohttp.ClientSession:
+    return create_async_session()
+
+
+def run_daemon(interval: float, use_async: bool = False) -> Scheduler:
+    """
+    Sweep every `interval` seconds keeping caches, cooldowns, the delivery
+    queue and pooled connections warm until SIGTERM or SIGINT.
+    Async sweeps run on one event loop sharing one HTTP session.
+    """
+    state = SweepState.create()
+    loop = asyncio.new_event_loop()
+    if use_async:
+        state.http = loop.run_until_complete(open_http_session())
+
+    def sweep() -> SweepResult:
+        if use_async:
+            result = loop.run_until_complete(main_async(state=state))
+        else:
+            result = main(state=state)
+        logger.info(f"Sweep finished: {result}")
+        return result
+
+    if settings.METRICS_PORT:
+        start_http_server(settings.METRICS_PORT)
+    scheduler = Scheduler(sweep, interval)
+    signal.signal(signal.SIGTERM, scheduler.stop)
+    signal.signal(signal.SIGINT, scheduler.stop)
+    logger.info(f"Sweeping every {interval}s")
+    try:
+        scheduler.run()
+    finally:
+        state.close()
+        if state.http is not None:
+            loop.run_until_complete(state.http.close())
+        loop.close()
+    logger.info(f"Scheduler stopped: {scheduler.stats()}")
+    return scheduler
+
+
+def run_shard(index: int, count: int, use_async: bool) -> Tuple[SweepResult, dict]:
+    """
+    Entry point of a worker process, sweeps users of one shard.
+    Return the result and metrics of the shard.
+    """
+    metrics.clear()
+    if use_async:
+        result = asyncio.run(main_async(shard=(index, count)))
+    else:
+        result = main(shard=(index, count))
+    return result, metrics.dump()
+
+
+def main_sharded(workers: int, use_async: bool = False) -> SweepResult:
+    """
+    Sweep users split by ID across `workers` processes.
+    """
+    before = metrics.snapshot()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(run_shard, index, workers, use_async)
+            for index in range(workers)
+        ]
+        results = []
+        for future in futures:
+            result, dump = future.result()
+            metrics.merge(dump)
+            results.append(result)
+    result = sum(results, SweepResult())
+    logger.info(f"Sweep finished across {workers} shards: {result}")
+    report_sweep(before, None)
+    return result
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Check user triggers")
+    parser.add_argument("user_id", type=int, nargs="?", help="Check only this user")
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="Fetch positions of all users concurrently",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Split users by ID across this many processes",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running and sweep every --interval seconds",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=settings.SWEEP_INTERVAL,
+        help="Seconds between sweeps in daemon mode",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Evaluate triggers on every price update from the streaming API",
+    )
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    if args.stream and (args.daemon or args.workers > 1 or args.user_id is not None):
+        parser.error("--stream evaluates all users in one process")
+    if args.daemon and (args.workers > 1 or args.user_id is not None):
+        parser.error("--daemon sweeps all users in one process")
+    return args
 
 
 if __name__ == "__main__":
-    user_id = None
-    if len(sys.argv) == 2:
-        user_id = int(sys.argv[1])
-    main(user_id)
+    args = parse_args()
+    with profiling.profile_if_requested("triggers", args):
+        if args.stream:
+            asyncio.run(streaming.main())
+        elif args.daemon:
+            run_daemon(args.interval, args.use_async)
+        elif args.workers > 1:
+            main_sharded(args.workers, args.use_async)
+        elif args.use_async:
+            asyncio.run(main_async(args.user_id))
+        else:
+            main(args.user_id)
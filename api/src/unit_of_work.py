@@ -0,0 +1,109 @@
+"""
+Batched database writes of a sweep.
+"""
+import json
+import time
+from datetime import datetime
+from dataclasses import dataclass
+from typing import Dict, List, Set
+
+from loguru import logger
+from sqlalchemy import delete, insert
+from sqlalchemy.orm.session import Session
+
+from api.src import database, schemas
+
+
+@dataclass
+class FlushStats:
+    alerts: int = 0
+    triggers: int = 0
+    snapshots: int = 0
+    seconds: float = 0.0
+
+
+class UnitOfWork:
+    """
+    Collect new alerts, stale triggers and position snapshots, then write them
+    with bulk INSERTs and one DELETE ... IN per user inside a single transaction.
+    """
+
+    def __init__(self, session: Session):
+        self.session = session
+        self._alerts: List[dict] = []
+        self._stale_tickers: Dict[int, Set[str]] = {}
+        self._snapshots: List[dict] = []
+
+    def add_alert(
+        self, user: schemas.User, trigger: schemas.Trigger, ticker: str
+    ) -> datetime:
+        """
+        Schedule insert of an alert, return its creation time.
+        """
+        now = datetime.utcnow()
+        self._alerts.append(
+            {
+                "trigger_id": trigger.id,
+                "user_id": user.id,
+                "ticker": ticker,
+                "created_at": now,
+                "updated_at": now,
+            }
+        )
+        return now
+
+    def delete_triggers(self, user: schemas.User, tickers: List[str]) -> None:
+        """
+        Delete triggers of a user for the given tickers.
+        """
+        if tickers:
+            self._stale_tickers.setdefault(user.id, set()).update(tickers)
+
+    def save_positions(
+        self, user: schemas.User, positions: List[schemas.PortfolioPosition]
+    ) -> None:
+        """
+        Replace snapshot of the user positions served by the bot.
+        """
+        self._snapshots.append(
+            {
+                "user_id": user.id,
+                "positions": json.dumps([p.to_dict() for p in positions]),
+                "created_at": datetime.utcnow(),
+            }
+        )
+
+    def flush(self) -> FlushStats:
+        stats = FlushStats()
+        start = time.perf_counter()
+        try:
+            if self._alerts:
+                self.session.execute(insert(database.Alert), self._alerts)
+                stats.alerts = len(self._alerts)
+            for user_id, tickers in self._stale_tickers.items():
+                result = self.session.execute(
+                    delete(database.Trigger)
+                    .where(database.Trigger.user_id == user_id)
+                    .where(database.Trigger.ticker.in_(sorted(tickers)))
+                )
+                stats.triggers += result.rowcount
+            if self._snapshots:
+                self.session.execute(
+                    insert(database.PositionSnapshot).prefix_with("OR REPLACE"),
+                    self._snapshots,
+                )
+                stats.snapshots = len(self._snapshots)
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        finally:
+            self._alerts = []
+            self._stale_tickers = {}
+            self._snapshots = []
+        stats.seconds = time.perf_counter() - start
+        logger.info(
+            f"Saved {stats.alerts} alerts, {stats.snapshots} snapshots, "
+            f"deleted {stats.triggers} triggers in {stats.seconds:.3f}s"
+        )
+        return stats
@@ -1,16 +1,18 @@
 """
 Database queries and utility functions.
 """
-from typing import List, Optional
+import json
+from typing import List, Optional, Set, Tuple
 from datetime import datetime, timedelta
 
 import telegram
-from sqlalchemy import desc
+from sqlalchemy import and_, desc, func, or_
 from sqlalchemy.orm.session import Session
 from tinvest.schemas import PortfolioPosition
 
 from api.src import database, schemas
 from api.src.config import settings
+from api.src.metrics import metrics
 
 
 def clean_unused_triggers(
@@ -22,39 +24,77 @@ def clean_unused_triggers(
     """
     Remove triggers from the database for symbols that user no longer have.
     """
-    tickers = [p.ticker for p in positions]
-    unused_triggers = [t for t in triggers if (t.ticker and t.ticker not in tickers)]
-    for trigger in unused_triggers:
-        query = session.query(database.Trigger)
-        query = query.filter(database.Trigger.user_id == user.id)
-        query = query.filter(database.Trigger.ticker == trigger.ticker)
-        query.delete()
-        session.commit()
+    unused_tickers = get_unused_tickers(triggers, positions)
+    if not unused_tickers:
+        return
+    query = session.query(database.Trigger)
+    query = query.filter(database.Trigger.user_id == user.id)
+    query = query.filter(database.Trigger.ticker.in_(unused_tickers))
+    query.delete(synchronize_session=False)
+    session.commit()
+
+
+def get_unused_tickers(
+    triggers: List[schemas.Trigger], positions: List[schemas.PortfolioPosition]
+) -> List[str]:
+    """
+    Return tickers of triggers for symbols that user no longer have.
+    """
+    tickers = {p.ticker for p in positions}
+    unused = {t.ticker for t in triggers if (t.ticker and t.ticker not in tickers)}
+    return sorted(unused)
 
 
 def get_user_triggers(user_id: int, session: Session) -> List[schemas.Trigger]:
     """
     Return triggers for a given user.
     """
-    triggers = (
-        session.query(database.Trigger)
-        .filter(database.Trigger.user_id == user_id)
-        .all()
-    )
+    with metrics.stage("load_triggers"):
+        triggers = (
+            session.query(database.Trigger)
+            .filter(database.Trigger.user_id == user_id)
+            .all()
+        )
     return [schemas.Trigger.from_model(trigger) for trigger in triggers]
 
 
-def get_user_alerts(user_id: int, session: Session) -> List[schemas.Alert]:
+def get_user_alerts(
+    user_id: int,
+    session: Session,
+    after: Optional[Tuple[datetime, int]] = None,
+    limit: int = 10,
+) -> List[schemas.AlertDetails]:
     """
-    Return alerts for a given user.
+    Return alerts for a given user with their triggers, newest first.
+    Pass (created_at, id) of the last returned alert as `after` to get
+    the next page, every page costs the same index range scan.
     """
-    alerts = (
-        session.query(database.Alert)
-        .order_by(desc(database.Alert.created_at))
+    query = (
+        session.query(database.Alert, database.Trigger)
+        .outerjoin(database.Trigger, database.Trigger.id == database.Alert.trigger_id)
         .filter(database.Alert.user_id == user_id)
-        .limit(10)
     )
-    return [schemas.Alert.from_model(alert) for alert in alerts]
+    if after is not None:
+        created_at, alert_id = after
+        query = query.filter(
+            or_(
+                database.Alert.created_at < created_at,
+                and_(
+                    database.Alert.created_at == created_at,
+                    database.Alert.id < alert_id,
+                ),
+            )
+        )
+    rows = query.order_by(
+        desc(database.Alert.created_at), desc(database.Alert.id)
+    ).limit(limit)
+    return [
+        schemas.AlertDetails(
+            schemas.Alert.from_model(alert),
+            None if trigger is None else schemas.Trigger.from_model(trigger),
+        )
+        for alert, trigger in rows
+    ]
 
 
 def get_users(session: Session) -> List[schemas.User]:
@@ -65,6 +105,36 @@ def get_users(session: Session) -> List[schemas.User]:
     return [schemas.User.from_model(user) for user in users]
 
 
+def get_triggers_version(session: Session) -> tuple:
+    """
+    Return value that changes whenever a trigger is created or deleted,
+    used by other processes to notice changes made by the bot.
+    """
+    return tuple(
+        session.query(
+            func.count(database.Trigger.id),
+            func.max(database.Trigger.id),
+            func.max(database.Trigger.updated_at),
+        ).one()
+    )
+
+
+def get_trigger_ids(session: Session) -> Set[int]:
+    return {trigger_id for trigger_id, in session.query(database.Trigger.id)}
+
+
+def get_triggers_updated_since(
+    since: Optional[datetime], session: Session
+) -> List[schemas.Trigger]:
+    """
+    Return triggers created or updated at or after `since`, all if it is None.
+    """
+    query = session.query(database.Trigger)
+    if since is not None:
+        query = query.filter(database.Trigger.updated_at >= since)
+    return [schemas.Trigger.from_model(trigger) for trigger in query]
+
+
 def get_user_trigger_alerts(
     user_id: int, trigger_id: int, session: Session
 ) -> List[schemas.Alert]:
@@ -81,6 +151,45 @@ def get_user_trigger_alerts(
     return [schemas.Alert.from_model(alert) for alert in alerts]
 
 
+def get_position_snapshot(
+    user_id: int, session: Session
+) -> Optional[schemas.PositionSnapshot]:
+    """
+    Return positions of a user saved by the last sweep or refresh.
+    """
+    snapshot = (
+        session.query(database.PositionSnapshot)
+        .filter(database.PositionSnapshot.user_id == user_id)
+        .first()
+    )
+    if snapshot is None:
+        return None
+    positions = json.loads(snapshot.positions)
+    return schemas.PositionSnapshot(
+        [schemas.PortfolioPosition(**position) for position in positions],
+        snapshot.created_at,
+    )
+
+
+def get_users_with_snapshots(
+    session: Session, newer_than: datetime, older_than: datetime
+) -> List[schemas.User]:
+    """
+    Return users whose positions snapshot was saved within the given period.
+    """
+    users = (
+        session.query(database.User)
+        .join(
+            database.PositionSnapshot,
+            database.PositionSnapshot.user_id == database.User.id,
+        )
+        .filter(database.PositionSnapshot.created_at > newer_than)
+        .filter(database.PositionSnapshot.created_at <= older_than)
+        .all()
+    )
+    return [schemas.User.from_model(user) for user in users]
+
+
 def get_user_by_username(username: str, session: Session) -> Optional[schemas.User]:
     query = session.query(database.User)
     user = query.filter(database.User.username == username).first()
@@ -93,8 +202,15 @@ def send_alert(
     user: schemas.User, trigger: schemas.Trigger, position: schemas.PortfolioPosition
 ) -> None:
     client = telegram.Bot(token=settings.BOT_TOKEN)
-    text = f"{position.name}\n{str(trigger)}"
-    client.sendMessage(chat_id=user.chat_id, text=text)
+    text = get_alert_text(trigger, position)
+    with metrics.upstream("telegram"):
+        client.sendMessage(chat_id=user.chat_id, text=text)
+
+
+def get_alert_text(
+    trigger: schemas.Trigger, position: schemas.PortfolioPosition
+) -> str:
+    return f"{position.name}\n{str(trigger)}"
 
 
 def save_alert(
@@ -105,18 +221,36 @@ def save_alert(
     session.commit()
 
 
+def delete_alert(
+    trigger_id: int, ticker: Optional[str], created_at: datetime, session: Session
+) -> None:
+    session.query(database.Alert).filter(
+        database.Alert.trigger_id == trigger_id,
+        database.Alert.ticker == ticker,
+        database.Alert.created_at == created_at,
+    ).delete()
+    session.commit()
+
+
+# How long an alert silences its trigger for the same ticker
+ALERT_WINDOWS = {
+    schemas.CandleRange.CANDLE_1D: timedelta(days=1),
+    schemas.CandleRange.CANDLE_1W: timedelta(days=7),
+    schemas.CandleRange.CANDLE_1M: timedelta(days=30),
+    schemas.TriggerReference.PORTFOLIO: timedelta(days=14),
+}
+
+
+def get_alert_window(reference: schemas.TriggerReference) -> timedelta:
+    return ALERT_WINDOWS.get(reference, timedelta(days=7))
+
+
 def should_ignore(trigger: schemas.Trigger, position: PortfolioPosition) -> bool:
     """
     Ignore trigger if alert already present in the database.
     """
-    alert_threshold = datetime.now() - timedelta(days=7)
-    if trigger.reference == schemas.CandleRange.CANDLE_1D:
-        alert_threshold = datetime.now() - timedelta(days=1)
-    if trigger.reference == schemas.CandleRange.CANDLE_1M:
-        alert_threshold = datetime.now() - timedelta(days=30)
-    if trigger.reference == schemas.TriggerReference.PORTFOLIO:
-        alert_threshold = datetime.now() - timedelta(days=14)
-    with database.get_db_session() as session:
+    alert_threshold = datetime.utcnow() - get_alert_window(trigger.reference)
+    with metrics.stage("should_ignore"), database.get_db_session() as session:
         query = session.query(database.Alert)
         query = query.order_by(desc(database.Alert.created_at))
         query = query.filter(database.Alert.trigger_id == trigger.id)
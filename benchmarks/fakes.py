@@ -0,0 +1,114 @@
+"""
+In-process stand-ins for Tinkoff and Telegram with configurable latency.
+"""
+import json
+import time
+import random
+import threading
+import datetime
+from types import SimpleNamespace
+from typing import Dict, List, Tuple
+
+import tinvest
+
+
+class Counters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.values: Dict[str, int] = {}
+
+    def increment(self, name: str) -> None:
+        with self._lock:
+            self.values[name] = self.values.get(name, 0) + 1
+
+
+class FakeMarket:
+    """
+    Deterministic prices and portfolios of generated users.
+    """
+
+    def __init__(self, tickers: int, seed: int = 0):
+        rng = random.Random(seed)
+        self.tickers = [f"T{i:04d}" for i in range(tickers)]
+        self.prices = {t: round(rng.uniform(10, 1000), 2) for t in self.tickers}
+        self.portfolios: Dict[str, List[Tuple[str, float]]] = {}
+
+    def add_portfolio(self, token: str, tickers: List[str], rng: random.Random):
+        self.portfolios[token] = [
+            (t, round(self.prices[t] * rng.uniform(0.7, 1.3), 2)) for t in tickers
+        ]
+
+
+class FakeClient:
+    def __init__(self, transport: "FakeTransport", token: str):
+        self.transport = transport
+        self.token = token
+
+    def get_portfolio(self):
+        self.transport.call("portfolio")
+        positions = [
+            SimpleNamespace(
+                ticker=ticker,
+                figi=f"FIGI-{ticker}",
+                name=ticker,
+                instrument_type=tinvest.schemas.InstrumentType.stock,
+                average_position_price=SimpleNamespace(value=price),
+            )
+            for ticker, price in self.transport.market.portfolios[self.token]
+        ]
+        return SimpleNamespace(payload=SimpleNamespace(positions=positions))
+
+    def get_market_candles(self, figi, from_, to, interval):
+        self.transport.call("candles")
+        price = self.transport.market.prices[figi.replace("FIGI-", "")]
+        days = max((to - from_).days, 1)
+        candles = [
+            SimpleNamespace(
+                h=price * (1 + d / 500),
+                l=price * (1 - d / 1000),
+                time=to - datetime.timedelta(days=d),
+            )
+            for d in range(days, 0, -1)
+        ]
+        return SimpleNamespace(payload=SimpleNamespace(candles=candles))
+
+
+class FakeTransport:
+    """
+    Replaces api.src.transport.Transport, every upstream call sleeps `latency`.
+    """
+
+    def __init__(self, market: FakeMarket, latency: float):
+        self.market = market
+        self.latency = latency
+        self.counters = Counters()
+
+    def call(self, name: str) -> None:
+        self.counters.increment(name)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_client(self, token: str) -> FakeClient:
+        return FakeClient(self, token)
+
+    def post(self, url: str, **kwargs):
+        self.call("list")
+        values = [
+            {"symbol": {"ticker": t}, "price": {"value": self.market.prices[t]}}
+            for t in kwargs["json"]["tickers"]
+        ]
+        return SimpleNamespace(text=json.dumps({"payload": {"values": values}}))
+
+    def stats(self) -> dict:
+        return dict(self.counters.values)
+
+
+class FakeTelegram:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.counters = Counters()
+
+    def send(self, chat_id: str, text: str) -> None:
+        self.counters.increment("messages")
+        if self.latency:
+            time.sleep(self.latency)
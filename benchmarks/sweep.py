@@ -0,0 +1,200 @@
+"""
+Synthetic-load benchmark of the trigger sweep.
+
+Generates users, positions and triggers into a temporary SQLite database,
+replaces Tinkoff and Telegram with in-process fakes and runs triggers.main.
+Example:
+>>> ENVIRONMENT=testing python -m benchmarks.sweep --scenario small --save
+"""
+import os
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+from unittest import mock
+from typing import Dict, Optional
+
+from loguru import logger
+from sqlalchemy import event, insert
+
+from api.src import database, migrations, triggers
+from api.src.cache import MarketDataCache
+from api.src.config import settings
+from api.src.delivery import DeliveryQueue
+from benchmarks.fakes import FakeMarket, FakeTelegram, FakeTransport
+
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+SCENARIOS = {
+    "small": {"users": 50, "positions": 10, "triggers": 5, "tickers": 100},
+    "medium": {"users": 500, "positions": 15, "triggers": 8, "tickers": 500},
+    "large": {"users": 2000, "positions": 20, "triggers": 10, "tickers": 2000},
+}
+REFERENCES = ["PORTFOLIO", "CANDLE_1D", "CANDLE_1W", "CANDLE_1M"]
+# Metrics that depend on the machine, compared but not expected to match
+TIMING_METRICS = {"wall_time", "peak_memory_mb"}
+
+
+def populate(engine, market: FakeMarket, params: dict, seed: int) -> None:
+    rng = random.Random(seed)
+    users, user_triggers = [], []
+    for user_id in range(1, params["users"] + 1):
+        token = f"token-{user_id}"
+        tickers = rng.sample(market.tickers, params["positions"])
+        market.add_portfolio(token, tickers, rng)
+        users.append(
+            {
+                "id": user_id,
+                "token": token,
+                "chat_id": f"chat-{user_id}",
+                "username": f"user-{user_id}",
+            }
+        )
+        for _ in range(params["triggers"]):
+            user_triggers.append(
+                {
+                    "user_id": user_id,
+                    "ticker": rng.choice(tickers + [None]),
+                    "reference": rng.choice(REFERENCES),
+                    "direction": rng.choice(["INCREASE", "DECREASE"]),
+                    "threshold": rng.choice([1, 5, 10, 20, 30]),
+                }
+            )
+    with engine.begin() as connection:
+        connection.execute(insert(database.User), users)
+        connection.execute(insert(database.Trigger), user_triggers)
+
+
+def run(
+    params: dict, latency: float, telegram_latency: float, sweeps: int, seed: int
+) -> dict:
+    """
+    Run `sweeps` sweeps sharing state like the daemon does, return metrics.
+    """
+    market = FakeMarket(params["tickers"], seed)
+    transport = FakeTransport(market, latency)
+    telegram = FakeTelegram(telegram_latency)
+    with tempfile.TemporaryDirectory() as path:
+        engine = database.create_db_engine(f"sqlite:///{path}/benchmark.db")
+        migrations.migrate(engine)
+        populate(engine, market, params, seed)
+        statements = [0]
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def count_statement(*args) -> None:
+            statements[0] += 1
+
+        state = triggers.SweepState(
+            cache=MarketDataCache(settings.MARKET_CACHE_TTL),
+            delivery=DeliveryQueue(
+                send=telegram.send, coalesce_window=0.01, global_rate=1e6
+            ),
+        )
+        results = []
+        with mock.patch.object(
+            database, "get_db_engine", lambda: engine
+        ), mock.patch.object(
+            triggers.tinkoff, "get_transport", lambda: transport
+        ), mock.patch.object(
+            triggers, "get_transport", lambda: transport
+        ):
+            for _ in range(sweeps):
+                statements[0] = 0
+                start = time.perf_counter()
+                result = triggers.main(state=state)
+                results.append(
+                    {
+                        "wall_time": round(time.perf_counter() - start, 3),
+                        "alerts": result.alerts,
+                        "db_statements": statements[0],
+                    }
+                )
+        state.close()
+        engine.dispose()
+    return {
+        "params": dict(params, latency=latency, telegram_latency=telegram_latency),
+        "sweeps": results,
+        "upstream_calls": transport.stats(),
+        "telegram_messages": telegram.counters.values.get("messages", 0),
+        "peak_memory_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+    }
+
+
+def flatten(result: dict, prefix: str = "") -> Dict[str, float]:
+    metrics = {}
+    for key, value in result.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            metrics.update(flatten(value, f"{name}."))
+        elif isinstance(value, list):
+            for i, item in enumerate(value):
+                metrics.update(flatten(item, f"{name}.{i}."))
+        elif isinstance(value, (int, float)) and not name.startswith("params."):
+            metrics[name] = value
+    return metrics
+
+
+def compare(result: dict, baseline: dict) -> str:
+    """
+    Return metrics that differ from the baseline, one per line.
+    """
+    current, previous = flatten(result), flatten(baseline)
+    lines = []
+    for name in sorted(set(current) | set(previous)):
+        new, old = current.get(name), previous.get(name)
+        if new == old:
+            continue
+        change = ""
+        if new is not None and old:
+            change = f" ({(new - old) / old * 100:+.1f}%)"
+        timing = " [timing]" if name.split(".")[-1] in TIMING_METRICS else ""
+        lines.append(f"{name}: {old} -> {new}{change}{timing}")
+    return "\n".join(lines) or "No differences"
+
+
+def get_baseline_path(scenario: str) -> str:
+    return os.path.join(BASELINES_PATH, f"sweep_{scenario}.json")
+
+
+def load_baseline(scenario: str) -> Optional[dict]:
+    path = get_baseline_path(scenario)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the trigger sweep")
+    parser.add_argument("--scenario", choices=SCENARIOS, default="small")
+    parser.add_argument("--users", type=int, help="Override number of users")
+    parser.add_argument("--positions", type=int, help="Override positions per user")
+    parser.add_argument("--triggers", type=int, help="Override triggers per user")
+    parser.add_argument("--latency", type=float, default=0.005, help="Tinkoff, s")
+    parser.add_argument("--telegram-latency", type=float, default=0.005)
+    parser.add_argument("--sweeps", type=int, default=2, help="Sweeps sharing state")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", action="store_true", help="Store as baseline")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    params = dict(SCENARIOS[args.scenario])
+    for name in ("users", "positions", "triggers"):
+        if getattr(args, name) is not None:
+            params[name] = getattr(args, name)
+    logger.disable("api")
+    result = run(params, args.latency, args.telegram_latency, args.sweeps, args.seed)
+    print(json.dumps(result, indent=2))
+    baseline = load_baseline(args.scenario)
+    if baseline is not None:
+        print(f"Compared to baseline:\n{compare(result, baseline)}")
+    if args.save:
+        with open(get_baseline_path(args.scenario), "w") as f:
+            json.dump(result, f, indent=2)
+            f.write("\n")
@@ -0,0 +1,42 @@
+import random
+
+from api.src import schemas, bands
+from tests.api.test_evaluation import random_position, random_trigger, TICKERS
+
+
+def test_index_matches_is_triggered():
+    rng = random.Random(1)
+    index = bands.BandIndex()
+    users = {}
+    for user_id in range(30):
+        positions = [random_position(rng, t) for t in TICKERS]
+        triggers = [random_trigger(rng, user_id * 10 + i, user_id) for i in range(8)]
+        index.set_user(user_id, triggers, positions)
+        users[user_id] = (triggers, positions)
+    for _ in range(20):
+        ticker, price = rng.choice(TICKERS), round(rng.uniform(40, 160), 2)
+        expected = set()
+        for triggers, positions in users.values():
+            for position in [p for p in positions if p.ticker == ticker]:
+                moved = schemas.PortfolioPosition(
+                    position.name,
+                    position.ticker,
+                    price,
+                    position.candle_prices,
+                    position.portfolio_price,
+                )
+                expected |= {t.id for t in triggers if t.is_triggered(moved)}
+        assert {b.trigger.id for b in index.fired(ticker, price)} == expected
+
+
+def test_index_supports_insert_and_delete(triggers):
+    index = bands.BandIndex()
+    position = schemas.PortfolioPosition("Tesla", "TSLA", 100, {"CANDLE_1D": 100}, 80)
+    index.set_user(triggers[0].user_id, [], [position])
+    index.add_trigger(triggers[0])
+    assert [b.trigger for b in index.fired("TSLA", 130)] == [triggers[0]]
+    assert index.get_user_triggers(triggers[0].user_id) == [triggers[0]]
+    index.remove_trigger(triggers[0].id)
+    assert index.fired("TSLA", 130) == []
+    assert index.get_user_triggers(triggers[0].user_id) == []
+    assert len(index) == 0
@@ -0,0 +1,10 @@
+from benchmarks import sweep
+
+
+def test_sweep_benchmark_reports_metrics():
+    params = {"users": 5, "positions": 3, "triggers": 2, "tickers": 10}
+    result = sweep.run(params, latency=0, telegram_latency=0, sweeps=2, seed=1)
+    assert len(result["sweeps"]) == 2
+    assert result["upstream_calls"]["portfolio"] == 10
+    assert result["sweeps"][0]["db_statements"] > 0
+    assert sweep.compare(result, result) == "No differences"
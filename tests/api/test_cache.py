@@ -0,0 +1,70 @@
+from api.src import tinkoff
+from api.src.cache import IdentityCache, TTLCache, MarketDataCache
+
+
+def test_ttl_cache_expires_entries():
+    now = [0.0]
+    cache = TTLCache(ttl=10, clock=lambda: now[0])
+    cache.set("key", 1)
+    assert cache.get("key") == 1
+    now[0] = 11
+    assert cache.get("key") is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "size": 0}
+
+
+def test_market_values_are_fetched_once_for_all_users(fake_market, portfolio_markets):
+    """
+    Second user holding the same markets should be served from the cache.
+    """
+    cache = MarketDataCache(ttl=60)
+    first = tinkoff.get_market_values(fake_market, portfolio_markets, cache)
+    candle_calls, list_calls = fake_market.candle_calls, fake_market.list_calls
+    second = tinkoff.get_market_values(fake_market, portfolio_markets, cache)
+    assert first == second
+    assert fake_market.candle_calls == candle_calls
+    assert fake_market.list_calls == list_calls == 1
+    assert cache.hits > 0
+
+
+def test_market_values_request_only_missing_tickers(fake_market, portfolio_markets):
+    cache = MarketDataCache(ttl=60)
+    cache.set_price("TSLA", 800.0)
+    values = tinkoff.get_market_values(fake_market, portfolio_markets, cache)
+    assert {v.ticker for v in values} == {"TSLA", "BABA"}
+    assert fake_market.list_calls == 1
+
+
+def test_identity_cache_loads_user_once(users):
+    cache = IdentityCache(ttl=60)
+    loads = []
+
+    def load():
+        loads.append(1)
+        return users[0]
+
+    assert cache.get_user(42, load) == users[0]
+    assert cache.get_user(42, load) == users[0]
+    assert len(loads) == 1
+    cache.invalidate(42)
+    assert cache.get_user(42, lambda: None) is None
+    assert cache.get_user(42, load) == users[0]
+    assert len(loads) == 2
+
+
+def test_clear_prices_keeps_candle_prices():
+    cache = MarketDataCache(ttl=60)
+    cache.set_price("TSLA", 100)
+    cache.set_candle_prices("FIGI", {"CANDLE_1D": 90})
+    cache.clear_prices()
+    assert cache.get_price("TSLA") is None
+    assert cache.get_candle_prices("FIGI", ["CANDLE_1D"]) == {"CANDLE_1D": 90}
+
+
+def test_price_ttl_expires_only_prices():
+    now = [0]
+    cache = MarketDataCache(ttl=60, clock=lambda: now[0], price_ttl=10)
+    cache.set_price("TSLA", 100)
+    cache.set_candle_prices("FIGI", {"CANDLE_1D": 90})
+    now[0] = 20
+    assert cache.get_price("TSLA") is None
+    assert cache.get_candle_prices("FIGI", ["CANDLE_1D"]) == {"CANDLE_1D": 90}
@@ -0,0 +1,44 @@
+from datetime import datetime, timedelta
+
+from api.src import database
+from api.src.cooldown import AlertCooldowns
+
+
+def test_cooldowns_are_loaded_with_latest_alert(session, users, triggers):
+    now = datetime.utcnow()
+    for days in [5, 0.5]:
+        alert = {
+            "trigger_id": triggers[0].id,
+            "user_id": users[0].id,
+            "ticker": "TSLA",
+            "created_at": now - timedelta(days=days),
+        }
+        session.add(database.Alert(**alert))
+    session.flush()
+    cooldowns = AlertCooldowns.load(session)
+    assert cooldowns.should_ignore(triggers[0], "TSLA", now)
+    assert not cooldowns.should_ignore(triggers[0], "TSLA", now + timedelta(days=1))
+    assert not cooldowns.should_ignore(triggers[0], "BABA", now)
+
+
+def test_cooldown_window_depends_on_reference(triggers):
+    """
+    Daily candle trigger is silenced for a day, portfolio trigger for two weeks.
+    """
+    now = datetime.utcnow()
+    cooldowns = AlertCooldowns()
+    cooldowns.record(triggers[0].id, "TSLA", now - timedelta(days=3))
+    cooldowns.record(triggers[2].id, "GOOG", now - timedelta(days=3))
+    assert not cooldowns.should_ignore(triggers[0], "TSLA", now)
+    assert cooldowns.should_ignore(triggers[2], "GOOG", now)
+
+
+def test_cooldown_compares_utc_timestamps(triggers):
+    """
+    Alerts are stored in UTC, so the default `now` must be UTC as well.
+    """
+    cooldowns = AlertCooldowns()
+    cooldowns.record(triggers[0].id, "TSLA", datetime.utcnow() - timedelta(hours=23))
+    cooldowns.record(triggers[0].id, "BABA", datetime.utcnow() - timedelta(hours=25))
+    assert cooldowns.should_ignore(triggers[0], "TSLA")
+    assert not cooldowns.should_ignore(triggers[0], "BABA")
@@ -0,0 +1,16 @@
+from sqlalchemy import text
+
+from api.src import database
+
+
+def test_engine_is_created_once_per_process():
+    assert database.get_db_engine() is database.get_db_engine()
+
+
+def test_engine_sets_sqlite_pragmas(tmp_path):
+    engine = database.create_db_engine(f"sqlite:///{tmp_path}/test.db")
+    with engine.connect() as connection:
+        journal_mode = connection.execute(text("PRAGMA journal_mode")).scalar()
+        synchronous = connection.execute(text("PRAGMA synchronous")).scalar()
+    assert journal_mode == "wal"
+    assert synchronous == 1
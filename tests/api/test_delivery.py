@@ -0,0 +1,56 @@
+import time
+
+from api.src.delivery import MESSAGE_LIMIT, DeliveryQueue, RateLimiter, coalesce
+
+
+def test_messages_of_a_chat_are_coalesced():
+    sent = []
+    delivery = DeliveryQueue(send=lambda c, t: sent.append((c, t)), coalesce_window=1)
+    delivery.put("chat-1", "TSLA")
+    delivery.put("chat-1", "BABA")
+    delivery.put("chat-2", "GOOG")
+    delivery.close()
+    assert sorted(sent) == [("chat-1", "TSLA\n\nBABA"), ("chat-2", "GOOG")]
+    assert delivery.sent == 2
+
+
+def test_failed_messages_are_counted():
+    def send(chat_id, text):
+        raise ValueError("chat not found")
+
+    failed = []
+    delivery = DeliveryQueue(send=send, coalesce_window=0)
+    delivery.put("chat-1", "TSLA", on_failure=lambda: failed.append("TSLA"))
+    delivery.close()
+    assert (delivery.sent, delivery.failed) == (0, 1)
+    assert failed == ["TSLA"]
+
+
+def test_coalesced_messages_are_split_at_limit():
+    first, second = object(), object()
+    messages = [("a" * 3000, first), ("b" * 3000, second), ("c" * 9000, None)]
+    chunks = coalesce(messages)
+    assert all(len(text) <= MESSAGE_LIMIT for text, _ in chunks)
+    assert "".join(text.replace("\n\n", "") for text, _ in chunks) == "".join(
+        message for message, _ in messages
+    )
+    assert [callbacks for _, callbacks in chunks[:2]] == [[first], [second]]
+
+
+def test_rate_limiter_spaces_calls():
+    limiter = RateLimiter(rate=20)
+    start = time.monotonic()
+    for _ in range(3):
+        limiter.acquire()
+    assert time.monotonic() - start >= 0.09
+
+
+def test_idle_queue_without_coalescing_does_not_spin():
+    sent = []
+    delivery = DeliveryQueue(send=lambda c, t: sent.append(t), coalesce_window=0)
+    delivery.put("chat-1", "TSLA")
+    start = time.process_time()
+    time.sleep(0.5)
+    assert time.process_time() - start < 0.02
+    assert sent == ["TSLA"]
+    delivery.close()
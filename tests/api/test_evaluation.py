@@ -0,0 +1,87 @@
+import random
+
+from api.src import schemas, evaluation
+
+
+TICKERS = ["TSLA", "BABA", "GOOG", "NTLA"]
+REFERENCES = ["PORTFOLIO", "CANDLE_1D", "CANDLE_1W", "CANDLE_1M"]
+
+
+def random_position(rng: random.Random, ticker: str) -> schemas.PortfolioPosition:
+    return schemas.PortfolioPosition(
+        name=ticker,
+        ticker=ticker,
+        current_price=round(rng.uniform(50, 150), 2),
+        candle_prices={r: round(rng.uniform(50, 150), 2) for r in REFERENCES[1:]},
+        portfolio_price=round(rng.uniform(50, 150), 2),
+    )
+
+
+def random_trigger(rng: random.Random, idx: int, user_id: int) -> schemas.Trigger:
+    return schemas.Trigger(
+        idx,
+        user_id,
+        rng.choice(TICKERS + [None]),
+        rng.choice(REFERENCES),
+        rng.choice([0, 1, 5, 10, 25, 50]),
+        rng.choice(["INCREASE", "DECREASE"]),
+    )
+
+
+def test_batch_matches_is_triggered():
+    rng = random.Random(0)
+    batch = evaluation.TriggerBatch()
+    expected = []
+    for user_id in range(50):
+        tickers = rng.sample(TICKERS, rng.randint(0, len(TICKERS)))
+        positions = [random_position(rng, t) for t in tickers]
+        triggers = [random_trigger(rng, i, user_id) for i in range(rng.randint(0, 8))]
+        batch.add(user_id, triggers, positions)
+        for position in positions:
+            for trigger in triggers:
+                if trigger.is_triggered(position):
+                    expected.append((user_id, trigger, position))
+    assert expected
+    assert batch.evaluate() == expected
+
+
+def test_batch_without_pairs_returns_nothing(triggers):
+    batch = evaluation.TriggerBatch()
+    batch.add(0, triggers, [])
+    assert batch.evaluate() == []
+
+
+def test_gate_never_hides_fired_triggers():
+    rng = random.Random(2)
+    gate = evaluation.ChangeGate()
+    users = {}
+    for user_id in range(20):
+        positions = [random_position(rng, t) for t in TICKERS]
+        triggers = [random_trigger(rng, user_id * 10 + i, user_id) for i in range(6)]
+        users[user_id] = (triggers, positions)
+    for _ in range(30):
+        for user_id, (triggers, positions) in users.items():
+            for position in positions:
+                position.current_price *= rng.uniform(0.97, 1.03)
+            selected = gate.select(user_id, triggers, positions)
+            fired = {
+                (t.id, p.ticker)
+                for p in positions
+                for t in triggers
+                if t.is_triggered(p)
+            }
+            gated = {(t.id, p.ticker) for p in selected for t in triggers}
+            assert fired <= gated
+    assert gate.skipped > 0
+
+
+def test_gate_skips_unchanged_user(triggers):
+    gate = evaluation.ChangeGate()
+    position = schemas.PortfolioPosition("Tesla", "TSLA", 100, {"CANDLE_1D": 100}, 100)
+    assert gate.select(0, triggers, [position]) == [position]
+    position.current_price = 110
+    assert gate.select(0, triggers, [position]) == []
+    position.current_price = 125
+    assert gate.select(0, triggers, [position]) == [position]
+    assert gate.stats() == {"evaluated": 2, "skipped": 1, "users_skipped": 1}
+    assert gate.select(0, triggers[:1], [position]) == [position]
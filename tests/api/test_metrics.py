@@ -0,0 +1,52 @@
+import pytest
+
+from api.src import metrics as metrics_module
+from api.src.metrics import MetricsRegistry, get_summary
+
+
+def test_render_prometheus_text():
+    registry = MetricsRegistry()
+    registry.inc("bicklebow_alerts_fired_total", 3)
+    registry.observe("bicklebow_stage_seconds", 0.02, stage="evaluation")
+    registry.observe("bicklebow_stage_seconds", 7, stage="evaluation")
+    text = registry.render()
+    assert "# TYPE bicklebow_alerts_fired_total counter" in text
+    assert "bicklebow_alerts_fired_total 3" in text
+    assert 'bicklebow_stage_seconds_bucket{stage="evaluation",le="0.025"} 1' in text
+    assert 'bicklebow_stage_seconds_bucket{stage="evaluation",le="+Inf"} 2' in text
+    assert 'bicklebow_stage_seconds_count{stage="evaluation"} 2' in text
+
+
+def test_upstream_counts_requests_and_errors():
+    registry = MetricsRegistry()
+    before = registry.snapshot()
+    with registry.upstream("candles"):
+        pass
+    with pytest.raises(ValueError), registry.upstream("candles"):
+        raise ValueError()
+    summary = get_summary(before, registry.snapshot())
+    assert summary['bicklebow_upstream_requests_total{endpoint="candles"}'] == 2
+    assert summary['bicklebow_upstream_errors_total{endpoint="candles"}'] == 1
+    assert summary['bicklebow_upstream_seconds_count{endpoint="candles"}'] == 2
+
+
+def test_export_writes_file(tmp_path):
+    path = tmp_path / "bicklebow.prom"
+    metrics_module.metrics.inc("bicklebow_sweeps_total")
+    metrics_module.export(str(path))
+    assert "bicklebow_sweeps_total" in path.read_text()
+
+
+def test_merge_adds_metrics_of_another_registry():
+    shards = [MetricsRegistry(), MetricsRegistry()]
+    for shard in shards:
+        shard.inc("bicklebow_alerts_fired_total", 2)
+        shard.observe("bicklebow_stage_seconds", 0.02, stage="evaluation")
+    registry = MetricsRegistry()
+    for shard in shards:
+        registry.merge(shard.dump())
+    snapshot = registry.snapshot()
+    assert snapshot["bicklebow_alerts_fired_total"] == 4
+    assert snapshot['bicklebow_stage_seconds_count{stage="evaluation"}'] == 2
+    text = registry.render()
+    assert 'bicklebow_stage_seconds_bucket{stage="evaluation",le="0.025"} 2' in text
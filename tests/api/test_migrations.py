@@ -0,0 +1,62 @@
+from sqlalchemy import create_engine, desc, text
+
+from api.src import database, migrations
+
+INDEXES = {
+    "ix_triggers_user_id_ticker",
+    "ix_alerts_trigger_id_ticker_created_at",
+    "ix_alerts_user_id_created_at",
+}
+
+
+def get_indexes(connection) -> set:
+    rows = connection.execute(text("SELECT name FROM sqlite_master WHERE type='index'"))
+    return {row[0] for row in rows}
+
+
+def explain(connection, query) -> str:
+    sql = query.statement.compile(compile_kwargs={"literal_binds": True})
+    rows = connection.execute(text(f"EXPLAIN QUERY PLAN {sql}"))
+    return " ".join(row[-1] for row in rows)
+
+
+def test_migrate_adds_indexes_to_existing_database(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/legacy.db")
+    database.Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for index in INDEXES:
+            connection.execute(text(f"DROP INDEX {index}"))
+    assert migrations.migrate(engine) == len(migrations.MIGRATIONS)
+    with engine.connect() as connection:
+        assert INDEXES <= get_indexes(connection)
+        assert migrations.get_version(connection) == len(migrations.MIGRATIONS)
+
+
+def test_migrate_is_noop_on_current_database(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/new.db")
+    migrations.migrate(engine)
+    assert migrations.migrate(engine) == len(migrations.MIGRATIONS)
+
+
+def test_hot_queries_use_indexes(session):
+    alert_query = (
+        session.query(database.Alert)
+        .filter(database.Alert.trigger_id == 0)
+        .filter(database.Alert.ticker == "TSLA")
+        .order_by(desc(database.Alert.created_at))
+    )
+    user_alerts_query = (
+        session.query(database.Alert)
+        .filter(database.Alert.user_id == 0)
+        .order_by(desc(database.Alert.created_at))
+        .limit(10)
+    )
+    triggers_query = (
+        session.query(database.Trigger)
+        .filter(database.Trigger.user_id == 0)
+        .filter(database.Trigger.ticker == "TSLA")
+    )
+    connection = session.connection()
+    assert "ix_alerts_trigger_id_ticker_created_at" in explain(connection, alert_query)
+    assert "ix_alerts_user_id_created_at" in explain(connection, user_alerts_query)
+    assert "ix_triggers_user_id_ticker" in explain(connection, triggers_query)
@@ -0,0 +1,25 @@
+import threading
+
+from api.src.positions import PositionsFetcher
+
+
+def test_concurrent_requests_share_one_fetch(users):
+    release = threading.Event()
+    calls = []
+
+    def fetch(user):
+        calls.append(user.id)
+        release.wait(5)
+        return [user.id]
+
+    fetcher = PositionsFetcher(fetch, workers=2)
+    first, second = fetcher.submit(users[0]), fetcher.submit(users[0])
+    other = fetcher.submit(users[1])
+    assert first is second
+    release.set()
+    assert first.result(5) == [users[0].id]
+    assert other.result(5) == [users[1].id]
+    assert fetcher.submit(users[0]).result(5) == [users[0].id]
+    fetcher.shutdown()
+    assert sorted(calls) == [0, 0, 1]
+    assert (fetcher.requests, fetcher.fetches) == (4, 3)
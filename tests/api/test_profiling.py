@@ -0,0 +1,45 @@
+import time
+import pstats
+import argparse
+import threading
+
+from api.src import profiling
+
+
+def busy_worker(stop: threading.Event) -> None:
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_profile_writes_reports(tmp_path):
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_worker, args=(stop,), name="worker")
+    with profiling.profile("test", memory=True, directory=str(tmp_path)) as paths:
+        worker.start()
+        data = [str(i) for i in range(10000)]
+        time.sleep(0.1)
+        stop.set()
+        worker.join()
+    assert data
+    stats = pstats.Stats(paths["pstats"])
+    assert stats.total_calls > 0
+    lines = open(paths["collapsed"]).read().splitlines()
+    assert any(line.startswith("worker;") for line in lines)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    assert "peak" in open(paths["tracemalloc"]).read()
+
+
+def test_profile_without_memory_skips_tracemalloc(tmp_path):
+    with profiling.profile("test", directory=str(tmp_path)) as paths:
+        pass
+    assert "tracemalloc" not in paths
+    assert not list(tmp_path.glob("*.tracemalloc.txt"))
+
+
+def test_profile_if_requested_is_noop_by_default(tmp_path, monkeypatch):
+    parser = argparse.ArgumentParser()
+    profiling.add_arguments(parser)
+    monkeypatch.setattr(profiling.settings, "PROFILE_PATH", str(tmp_path))
+    with profiling.profile_if_requested("test", parser.parse_args([])):
+        pass
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,42 @@
+import time
+import threading
+
+from api.src.metrics import get_summary, metrics
+from api.src.scheduler import Scheduler
+
+
+def test_tick_is_skipped_while_previous_run_is_in_progress():
+    def job():
+        time.sleep(0.25)
+
+    scheduler = Scheduler(job, interval=0.1)
+    threading.Timer(0.45, scheduler.stop).start()
+    scheduler.run()
+    assert scheduler.runs == 2
+    assert scheduler.skipped >= 2
+    assert scheduler.duration >= 0.25
+
+
+def test_failed_run_does_not_stop_scheduler():
+    def job():
+        raise ValueError("upstream is down")
+
+    scheduler = Scheduler(job, interval=0.05)
+    threading.Timer(0.12, scheduler.stop).start()
+    scheduler.run()
+    assert scheduler.failed == scheduler.runs >= 2
+
+
+def test_scheduler_records_metrics():
+    def job():
+        time.sleep(0.15)
+
+    before = metrics.snapshot()
+    scheduler = Scheduler(job, interval=0.05, name="test")
+    threading.Timer(0.12, scheduler.stop).start()
+    scheduler.run()
+    summary = get_summary(before, metrics.snapshot())
+    assert summary['bicklebow_scheduler_duration_seconds_count{job="test"}'] == 1
+    assert summary['bicklebow_scheduler_lag_seconds_count{job="test"}'] == 1
+    assert summary['bicklebow_scheduler_ticks_skipped_total{job="test"}'] >= 1
+    assert 'bicklebow_scheduler_lag_seconds_bucket{job="test"' in metrics.render()
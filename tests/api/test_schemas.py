@@ -157,3 +157,24 @@ def test_trigger_return_message():
         direction=schemas.Direction.INCREASE.value,
     )
     assert str(trigger) == f"Increased by more than {trigger.threshold}% from portfolio"
+
+
+def test_position_keeps_candle_prices_in_slots():
+    candle_prices = {"CANDLE_1D": 1000, "CANDLE_1M": 900, "CANDLE_YTD": 800}
+    position = schemas.PortfolioPosition("Tesla", "TSLA", 950, candle_prices, 700)
+    assert not hasattr(position, "__dict__")
+    assert position.candle_1d_price == 1000
+    assert position.candle_1w_price is None
+    assert position.get_candle_price("CANDLE_YTD") == 800
+    assert position.to_dict()["candle_prices"] == candle_prices
+    assert schemas.PortfolioPosition(**position.to_dict()) == position
+
+
+def test_position_from_market_value():
+    market_value = schemas.MarketValue(
+        "TSLA", 950, candle_prices={"CANDLE_1D": 1000, "CANDLE_1W": 980}
+    )
+    position = schemas.PortfolioPosition.from_market_value("Tesla", market_value, 700)
+    assert position.candle_prices == market_value.candle_prices
+    assert position.current_price == 950
+    assert position.portfolio_price == 700
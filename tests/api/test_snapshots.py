@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, update
+
+from api.src import database, schemas
+from api.src.snapshots import SnapshotStore
+
+
+@pytest.fixture
+def store(tmp_path, users):
+    engine = create_engine(f"sqlite:///{tmp_path}/snapshots.db")
+    database.Base.metadata.create_all(engine)
+    with database.get_db_session(engine) as session:
+        session.add_all([database.User(**user.to_dict()) for user in users])
+    calls = []
+
+    def fetch(user):
+        calls.append(user.id)
+        return [schemas.PortfolioPosition("Tesla", "TSLA", 100, {}, 80)]
+
+    store = SnapshotStore(fetch, lambda: database.get_db_session(engine), 60, 600)
+    store.calls = calls
+    store.engine = engine
+    yield store
+    store.fetcher.shutdown()
+
+
+def set_age(store, seconds):
+    created_at = datetime.utcnow() - timedelta(seconds=seconds)
+    with database.get_db_session(store.engine) as session:
+        session.execute(update(database.PositionSnapshot).values(created_at=created_at))
+
+
+def test_missing_snapshot_is_fetched_and_saved(store, users):
+    assert store.get(users[0]) is None
+    snapshot = store.refresh(users[0]).result(5)
+    assert snapshot.positions[0].ticker == "TSLA"
+    assert store.get(users[0]).positions == snapshot.positions
+    assert store.calls == [users[0].id]
+    assert (store.hits, store.misses) == (1, 1)
+
+
+def test_stale_snapshot_is_served_while_refreshed(store, users):
+    store.refresh(users[0]).result(5)
+    set_age(store, 120)
+    snapshot = store.get(users[0])
+    assert snapshot.age > timedelta(seconds=60)
+    store.fetcher.shutdown()
+    assert store.calls == [users[0].id, users[0].id]
+    assert store.get(users[0]).age < timedelta(seconds=60)
+    set_age(store, 1200)
+    assert store.get(users[0]) is None
+    assert store.stats()["stale_hits"] == 1
+
+
+def test_expiring_snapshots_are_refreshed_ahead(store, users):
+    store.refresh(users[0]).result(5)
+    store.refresh(users[1]).result(5)
+    assert store.refresh_expiring(ahead=40) == 0
+    store.get(users[0])
+    store.get(users[1])
+    set_age(store, 30)
+    assert store.refresh_expiring(ahead=10) == 0
+    assert store.refresh_expiring(ahead=40) == 2
+    assert store.refresh_expiring(ahead=40, active=0) == 0
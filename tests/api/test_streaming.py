@@ -0,0 +1,111 @@
+import asyncio
+from unittest import mock
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+
+from api.src import database, schemas, streaming
+
+
+class FakeDelivery:
+    def __init__(self):
+        self.messages = []
+
+    def put(self, chat_id, text, on_failure=None):
+        self.messages.append((chat_id, text))
+
+
+def create_evaluator(session, portfolios):
+    @contextmanager
+    def session_factory():
+        yield session
+
+    def fetch(user, cache):
+        return portfolios.get(user.id, ([], {}))
+
+    feed = streaming.QueuePriceFeed()
+    evaluator = streaming.StreamingEvaluator(
+        feed, FakeDelivery(), fetch=fetch, session_factory=session_factory
+    )
+    return feed, evaluator
+
+
+def test_only_ticked_ticker_is_evaluated(session):
+    tesla = schemas.PortfolioPosition("Tesla", "TSLA", 100, {"CANDLE_1D": 100}, 100)
+    google = schemas.PortfolioPosition("Google", "GOOG", 100, {}, 100)
+    portfolios = {0: ([tesla, google], {"TSLA": "figi-tsla", "GOOG": "figi-goog"})}
+    feed, evaluator = create_evaluator(session, portfolios)
+
+    async def run():
+        await evaluator.refresh()
+        assert feed.subscriptions == {"figi-tsla", "figi-goog"}
+        feed.publish("figi-tsla", 130)
+        feed.publish("figi-goog", 95)
+        feed.publish("figi-tsla", 131)
+        await feed.close()
+        await evaluator.run_ticks()
+
+    asyncio.run(run())
+    assert evaluator.ticks == 3
+    assert evaluator.alerts == 1
+    assert len(evaluator.delivery.messages) == 1
+    alerts = session.query(database.Alert).filter_by(ticker="TSLA").all()
+    assert [a.trigger_id for a in alerts] == [0]
+
+
+def test_subscriptions_follow_portfolio(session):
+    tesla = schemas.PortfolioPosition("Tesla", "TSLA", 100, {"CANDLE_1D": 100}, 100)
+    google = schemas.PortfolioPosition("Google", "GOOG", 100, {}, 100)
+    portfolios = {0: ([tesla], {"TSLA": "figi-tsla"})}
+    feed, evaluator = create_evaluator(session, portfolios)
+
+    async def run():
+        await evaluator.refresh()
+        assert feed.subscriptions == {"figi-tsla"}
+        portfolios[0] = ([google], {"GOOG": "figi-goog"})
+        await evaluator.refresh()
+        assert feed.subscriptions == {"figi-goog"}
+
+    asyncio.run(run())
+
+
+def test_deleted_trigger_stops_firing_after_reload(session):
+    tesla = schemas.PortfolioPosition("Tesla", "TSLA", 100, {"CANDLE_1D": 100}, 100)
+    portfolios = {0: ([tesla], {"TSLA": "figi-tsla"})}
+    feed, evaluator = create_evaluator(session, portfolios)
+    asyncio.run(evaluator.refresh())
+    assert not evaluator.reload_triggers()
+    session.query(database.Trigger).filter_by(id=0).delete()
+    session.commit()
+    assert evaluator.reload_triggers()
+    assert evaluator.on_tick(streaming.PriceTick("figi-tsla", 130)) == 0
+
+
+def test_main_without_users_exits(in_memory_sqlite_db):
+    with mock.patch.object(database, "get_db_engine", lambda: in_memory_sqlite_db):
+        asyncio.run(streaming.main())
+
+
+def test_new_trigger_is_added_without_reloading_others(session):
+    tesla = schemas.PortfolioPosition("Tesla", "TSLA", 100, {"CANDLE_1D": 100}, 100)
+    portfolios = {0: ([tesla], {"TSLA": "figi-tsla"})}
+    feed, evaluator = create_evaluator(session, portfolios)
+    asyncio.run(evaluator.refresh())
+    session.query(database.Trigger).filter_by(id=0).delete()
+    session.add(
+        database.Trigger(
+            id=10,
+            user_id=0,
+            ticker="TSLA",
+            reference="PORTFOLIO",
+            threshold=5,
+            direction="DECREASE",
+            updated_at=datetime.utcnow() + timedelta(seconds=1),
+        )
+    )
+    session.commit()
+    with mock.patch.object(evaluator.index, "set_user") as set_user:
+        assert evaluator.reload_triggers()
+    set_user.assert_not_called()
+    assert {t.id for t in evaluator.index.get_user_triggers(0)} == {1, 2, 3, 10}
+    assert evaluator.on_tick(streaming.PriceTick("figi-tsla", 130)) == 0
+    assert evaluator.on_tick(streaming.PriceTick("figi-tsla", 90)) == 1
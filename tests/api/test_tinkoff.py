@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from tinvest.schemas import InstrumentType
+
+from api.src import tinkoff
+from api.src.cache import MarketDataCache
+
+
+def test_avg_prices_are_computed_from_one_request(fake_market):
+    prices = tinkoff.get_avg_prices_from_candles(fake_market, "FIGI-TSLA")
+    assert fake_market.candle_calls == 1
+    assert set(prices) == {"CANDLE_1D", "CANDLE_1W", "CANDLE_1M"}
+    assert prices["CANDLE_1D"] == 800.0
+
+
+def test_registered_window_does_not_add_requests(fake_market, monkeypatch):
+    monkeypatch.setitem(
+        tinkoff.CANDLE_WINDOWS, "CANDLE_3M", lambda now: now - timedelta(days=90)
+    )
+    prices = tinkoff.get_avg_prices_from_candles(fake_market, "FIGI-TSLA")
+    assert fake_market.candle_calls == 1
+    assert "CANDLE_3M" in prices
+
+
+def test_each_window_uses_its_first_candle(monkeypatch):
+    now = datetime(2021, 3, 31, 18)
+    # Newest first: one candle per day priced by its age, plus one two hours ago
+    ages = [timedelta(hours=2)] + [timedelta(days=d) for d in range(1, 31)]
+    prices = [99.0] + [100.0 + d for d in range(1, 31)]
+    response = candles_response(now, zip(ages, prices))
+    monkeypatch.setitem(
+        tinkoff.CANDLE_WINDOWS, "CANDLE_2W", lambda now: now - timedelta(days=14)
+    )
+    monkeypatch.setitem(tinkoff.CANDLE_WINDOWS, "CANDLE_LATEST", lambda now: now)
+    starts = tinkoff.get_candle_window_starts(now)
+    assert tinkoff.get_avg_prices_from_candles_response(response, starts) == {
+        "CANDLE_1D": 101.0,
+        "CANDLE_1W": 107.0,
+        "CANDLE_1M": 130.0,
+        "CANDLE_2W": 114.0,
+        # Nothing traded after the window start, so the latest candle is used
+        "CANDLE_LATEST": 99.0,
+    }
+
+
+def test_market_values_expose_candle_prices(fake_market, portfolio_markets):
+    values = tinkoff.get_market_values(fake_market, portfolio_markets)
+    assert fake_market.candle_calls == 2
+    for value in values:
+        assert value.candle_1w_price == value.candle_prices["CANDLE_1W"]
+
+
+def test_large_ticker_sets_are_fetched_in_chunks(fake_market, monkeypatch):
+    monkeypatch.setattr(tinkoff.settings, "MARKET_LIST_CHUNK_SIZE", 2)
+    fake_market.prices.update({f"T{i}": float(i) for i in range(7)})
+    tickers = [f"T{i}" for i in range(7)]
+    prices = tinkoff.get_current_prices(InstrumentType.stock, tickers)
+    assert prices == {f"T{i}": float(i) for i in range(7)}
+    assert fake_market.list_calls == 4
+
+
+def test_prices_of_all_portfolios_are_prefetched(fake_market):
+    portfolios = [
+        portfolio_response([("TSLA", "FIGI-TSLA"), ("BABA", "FIGI-BABA")]),
+        portfolio_response([("TSLA", "FIGI-TSLA"), ("GOOG", "FIGI-GOOG")]),
+    ]
+    cache = MarketDataCache(ttl=60)
+    tinkoff.prefetch_current_prices(portfolios, cache)
+    assert fake_market.list_calls == 1
+    assert cache.get_price("GOOG") == 1500.0
+
+
+def portfolio_response(symbols) -> SimpleNamespace:
+    positions = [
+        SimpleNamespace(ticker=t, figi=f, instrument_type=InstrumentType.stock)
+        for t, f in symbols
+    ]
+    return SimpleNamespace(payload=SimpleNamespace(positions=positions))
+
+
+def candles_response(now, candles) -> SimpleNamespace:
+    candles = [
+        SimpleNamespace(h=price + 0.5, l=price - 0.5, time=now - age)
+        for age, price in candles
+    ]
+    return SimpleNamespace(payload=SimpleNamespace(candles=candles))
@@ -0,0 +1,69 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from api.src import tinkoff_async
+from api.src.cache import MarketDataCache
+
+
+class FakeAsyncMarket:
+    """
+    Async wrapper around FakeMarket that yields to the event loop on every call.
+    """
+
+    def __init__(self, market):
+        self.market = market
+
+    async def get_market_candles(self, *args):
+        await asyncio.sleep(0.01)
+        return self.market.get_market_candles(*args)
+
+    @asynccontextmanager
+    async def post(self, url, **kwargs):
+        await asyncio.sleep(0.01)
+        response = self.market.post(url, **kwargs)
+
+        class Response:
+            async def text(self):
+                return response.text
+
+        yield Response()
+
+
+def test_concurrent_users_share_upstream_requests(fake_market, portfolio_markets):
+    async def sweep():
+        client = FakeAsyncMarket(fake_market)
+        limiter = tinkoff_async.RequestLimiter(total=10, per_token=2)
+        fetcher = tinkoff_async.MarketDataFetcher(
+            client, MarketDataCache(ttl=60), limiter
+        )
+        return await asyncio.gather(
+            *[
+                tinkoff_async.get_market_values(
+                    client, f"token-{i}", portfolio_markets, fetcher
+                )
+                for i in range(5)
+            ]
+        )
+
+    results = asyncio.run(sweep())
+    assert all(r == results[0] for r in results)
+    assert fake_market.candle_calls == 2
+    assert fake_market.list_calls == 1
+
+
+def test_limiter_bounds_requests_per_token():
+    running = {"now": 0, "max": 0}
+
+    async def request(limiter):
+        async with limiter.acquire("token"):
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+            await asyncio.sleep(0.01)
+            running["now"] -= 1
+
+    async def sweep():
+        limiter = tinkoff_async.RequestLimiter(total=10, per_token=2)
+        await asyncio.gather(*[request(limiter) for _ in range(6)])
+
+    asyncio.run(sweep())
+    assert running["max"] == 2
@@ -0,0 +1,35 @@
+import datetime
+
+import pytest
+
+from api.src import schemas, tinkoff
+from api.src.config import settings
+from api.src.tinkoff_server import RandomWalk, StandInMarket, StandInServer, create_app
+
+
+@pytest.fixture
+def stand_in(monkeypatch):
+    market = StandInMarket(RandomWalk(seed=1), tickers=20, positions=3)
+    server = StandInServer(create_app(market)).start()
+    monkeypatch.setattr(settings, "TINKOFF_API_URL", f"{server.url}/openapi")
+    monkeypatch.setattr(settings, "TINKOFF_TRADING_URL", f"{server.url}/api/trading")
+    yield market
+    server.stop()
+
+
+def test_random_walk_is_deterministic():
+    start = datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc)
+    first, second = RandomWalk(seed=3, start=start), RandomWalk(seed=3, start=start)
+    first.get_price("TSLA", 50)
+    assert first.get_price("TSLA", 100) == second.get_price("TSLA", 100)
+    assert first.get_price("TSLA", -30) == second.get_price("TSLA", -30)
+    other = RandomWalk(seed=4, start=start)
+    assert other.get_price("TSLA", 100) != first.get_price("TSLA", 100)
+
+
+def test_user_positions_are_served_by_stand_in(stand_in):
+    user = schemas.User(100, "stand-in-token", "stand-in", "chat")
+    positions = tinkoff.get_user_positions(user)
+    assert len(positions) == 3
+    assert all(set(p.candle_prices) == set(tinkoff.CANDLE_WINDOWS) for p in positions)
+    assert stand_in.stats["requests"] == 1 + 3 + 1
@@ -0,0 +1,43 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from api.src.transport import Transport
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+def test_transport_reuses_connections():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        transport = Transport()
+        url = f"http://127.0.0.1:{server.server_port}/list"
+        for _ in range(3):
+            transport.post(url, json={"tickers": []})
+        assert transport.stats()["requests"] == 3
+        assert transport.stats()["connections"] == 1
+        assert transport.stats()["reused"] == 2
+    finally:
+        server.shutdown()
+
+
+def test_client_pool_is_bounded():
+    transport = Transport(max_clients=2)
+    first = transport.get_client("token-1")
+    transport.get_client("token-2")
+    assert transport.get_client("token-1") is first
+    transport.get_client("token-3")
+    assert transport.stats()["clients"] == 2
+    assert transport.get_client("token-1") is first
@@ -0,0 +1,183 @@
+import asyncio
+from unittest import mock
+from types import SimpleNamespace
+
+import pytest
+
+from api.src import database, migrations, schemas, triggers
+from api.src.cache import MarketDataCache
+from api.src.delivery import DeliveryQueue
+from benchmarks.fakes import FakeMarket, FakeTelegram, FakeTransport
+
+
+class PartialTransport(FakeTransport):
+    """
+    Leaves `hidden` tickers out of list responses.
+    """
+
+    def __init__(self, market: FakeMarket, latency: float):
+        super().__init__(market, latency)
+        self.hidden = set()
+
+    def post(self, url: str, **kwargs):
+        tickers = [t for t in kwargs["json"]["tickers"] if t not in self.hidden]
+        return super().post(url, json={"tickers": tickers})
+
+
+@pytest.fixture
+def sweep(tmp_path):
+    engine = database.create_db_engine(f"sqlite:///{tmp_path}/sweep.db")
+    migrations.migrate(engine)
+    market = FakeMarket(tickers=3)
+    market.portfolios["token-1"] = [(t, market.prices[t]) for t in market.tickers[:2]]
+    transport = PartialTransport(market, latency=0)
+    telegram = FakeTelegram(latency=0)
+    with database.get_db_session(engine) as session:
+        session.add(database.User(id=1, token="token-1", chat_id="1", username="u"))
+        for ticker in market.tickers[:2]:
+            session.add(
+                database.Trigger(
+                    user_id=1,
+                    ticker=ticker,
+                    reference="PORTFOLIO",
+                    threshold=10,
+                    direction="INCREASE",
+                )
+            )
+    state = triggers.SweepState(
+        cache=MarketDataCache(300),
+        delivery=DeliveryQueue(send=telegram.send, coalesce_window=0, global_rate=1e6),
+    )
+    with mock.patch.object(
+        database, "get_db_engine", lambda: engine
+    ), mock.patch.object(
+        triggers.tinkoff, "get_transport", lambda: transport
+    ), mock.patch.object(
+        triggers, "get_transport", lambda: transport
+    ):
+        yield SimpleNamespace(
+            engine=engine,
+            market=market,
+            transport=transport,
+            telegram=telegram,
+            state=state,
+        )
+    state.close()
+    engine.dispose()
+
+
+def count_triggers(engine) -> int:
+    with database.get_db_session(engine) as session:
+        return session.query(database.Trigger).count()
+
+
+def test_shards_split_users_without_overlap():
+    users = [schemas.User(i, "test-token", f"user-{i}", "chat") for i in range(10)]
+    shards = [triggers.shard_users(users, (i, 3)) for i in range(3)]
+    ids = [u.id for shard in shards for u in shard]
+    assert sorted(ids) == list(range(10))
+    assert len(ids) == len(set(ids))
+
+
+def test_sweep_results_are_aggregated():
+    results = [triggers.SweepResult(2, 1, 0), triggers.SweepResult(3, 4, 1)]
+    assert sum(results, triggers.SweepResult()) == triggers.SweepResult(5, 5, 1)
+
+
+def test_user_with_unpriced_ticker_keeps_triggers(sweep):
+    sweep.transport.hidden = {sweep.market.tickers[1]}
+    result = triggers.main(state=sweep.state)
+    assert result.skipped == 1
+    assert count_triggers(sweep.engine) == 2
+    assert sweep.transport.stats()["list"] == 1
+
+
+def test_daemon_sweeps_see_new_prices(sweep):
+    assert triggers.main(state=sweep.state).alerts == 0
+    ticker = sweep.market.tickers[0]
+    sweep.market.prices[ticker] *= 1.5
+    assert triggers.main(state=sweep.state).alerts == 1
+    assert sweep.transport.stats()["list"] == 2
+    assert sweep.transport.stats()["candles"] == 2
+
+
+def test_undelivered_alert_fires_again(sweep):
+    def send(chat_id, text):
+        raise ValueError("chat not found")
+
+    sweep.state.delivery.close()
+    sweep.state.delivery = DeliveryQueue(send=send, coalesce_window=0)
+    sweep.market.prices[sweep.market.tickers[0]] *= 1.5
+    assert triggers.main(state=sweep.state).alerts == 1
+    sweep.state.delivery.close()
+    with database.get_db_session(sweep.engine) as session:
+        assert session.query(database.Alert).count() == 0
+    sweep.state.delivery = DeliveryQueue(send=sweep.telegram.send, coalesce_window=0)
+    assert triggers.main(state=sweep.state).alerts == 1
+
+
+def test_daemon_session_is_reused_and_kept_open(sweep):
+    async def run():
+        sweep.state.http = await triggers.open_http_session()
+        async with triggers.http_session(sweep.state) as http:
+            assert http is sweep.state.http
+        assert not sweep.state.http.closed
+        await sweep.state.http.close()
+
+    asyncio.run(run())
+
+
+def test_stalled_user_does_not_hold_up_async_sweep(sweep, monkeypatch):
+    with database.get_db_session(sweep.engine) as session:
+        session.add(database.User(id=2, token="token-2", chat_id="2", username="s"))
+
+    async def get_user_positions(user, fetcher):
+        if user.id == 2:
+            await asyncio.sleep(10)
+        ticker = sweep.market.tickers[0]
+        return [schemas.PortfolioPosition(ticker, ticker, 100, {}, 100)]
+
+    monkeypatch.setattr(triggers.settings, "SWEEP_USER_DEADLINE", 0.1)
+    monkeypatch.setattr(
+        triggers.tinkoff_async, "get_user_positions", get_user_positions
+    )
+    result = asyncio.run(triggers.main_async(state=sweep.state))
+    assert (result.users, result.skipped) == (1, 1)
+    with database.get_db_session(sweep.engine) as session:
+        assert session.query(database.PositionSnapshot).count() == 1
+
+
+def test_queued_users_are_not_skipped_by_deadline(sweep, monkeypatch):
+    with database.get_db_session(sweep.engine) as session:
+        for user_id in range(2, 11):
+            session.add(
+                database.User(
+                    id=user_id,
+                    token=f"token-{user_id}",
+                    chat_id=str(user_id),
+                    username=f"user-{user_id}",
+                )
+            )
+
+    async def get_user_positions(user, fetcher):
+        async with fetcher.limiter.acquire():
+            await asyncio.sleep(0.05)
+        ticker = sweep.market.tickers[0]
+        return [schemas.PortfolioPosition(ticker, ticker, 100, {}, 100)]
+
+    monkeypatch.setattr(triggers.settings, "SWEEP_CONCURRENCY", 2)
+    monkeypatch.setattr(triggers.settings, "SWEEP_USER_DEADLINE", 0.2)
+    monkeypatch.setattr(
+        triggers.tinkoff_async, "get_user_positions", get_user_positions
+    )
+    result = asyncio.run(triggers.main_async(state=sweep.state))
+    assert (result.users, result.skipped) == (10, 0)
+
+
+def test_failed_portfolio_skips_only_its_user(sweep):
+    with database.get_db_session(sweep.engine) as session:
+        # No portfolio in the fake market, so the portfolio request raises
+        session.add(database.User(id=2, token="token-2", chat_id="2", username="s"))
+    sweep.market.prices[sweep.market.tickers[0]] *= 1.5
+    result = triggers.main(state=sweep.state)
+    assert (result.users, result.skipped, result.alerts) == (1, 1, 1)
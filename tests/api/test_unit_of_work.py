@@ -0,0 +1,32 @@
+from api.src import database, schemas, utils
+from api.src.unit_of_work import UnitOfWork
+
+
+def test_flush_writes_alerts_and_deletes_triggers(session, users, triggers):
+    session.flush()
+    alerts_before = session.query(database.Alert).count()
+    unit_of_work = UnitOfWork(session)
+    unit_of_work.add_alert(users[0], triggers[0], "TSLA")
+    unit_of_work.add_alert(users[0], triggers[2], "GOOG")
+    unit_of_work.delete_triggers(users[0], ["BABA", "NTLA"])
+    stats = unit_of_work.flush()
+    assert (stats.alerts, stats.triggers) == (2, 2)
+    assert session.query(database.Alert).count() == alerts_before + 2
+    tickers = {t.ticker for t in session.query(database.Trigger)}
+    assert tickers == {"TSLA", "GOOG"}
+
+
+def test_flush_without_changes_writes_nothing(session):
+    stats = UnitOfWork(session).flush()
+    assert (stats.alerts, stats.triggers) == (0, 0)
+
+
+def test_flush_replaces_position_snapshots(session, users):
+    old = schemas.PortfolioPosition("Tesla", "TSLA", 100, {"CANDLE_1D": 90}, 80)
+    new = schemas.PortfolioPosition("Tesla", "TSLA", 110, {"CANDLE_1D": 90}, 80)
+    for positions in ([old], [new]):
+        unit_of_work = UnitOfWork(session)
+        unit_of_work.save_positions(users[0], positions)
+        assert unit_of_work.flush().snapshots == 1
+    assert utils.get_position_snapshot(users[0].id, session).positions == [new]
+    assert utils.get_position_snapshot(users[1].id, session) is None
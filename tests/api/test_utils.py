@@ -1,3 +1,5 @@
+from datetime import datetime, timedelta
+
 from api.src import utils, database, schemas
 
 
@@ -36,3 +38,31 @@ def test_get_user_by_username_returns_users(session, users):
     username = users[0].username
     user = utils.get_user_by_username(username, session)
     assert user.username == username
+
+
+def test_get_user_alerts_pages_through_history(session, users, triggers):
+    created_at = datetime(2021, 1, 1)
+    session.add_all(
+        [
+            database.Alert(
+                user_id=users[0].id,
+                trigger_id=triggers[i % 3].id,
+                created_at=created_at - timedelta(minutes=i // 2),
+            )
+            for i in range(25)
+        ]
+    )
+    session.flush()
+    pages, after = [], None
+    while True:
+        page = utils.get_user_alerts(users[0].id, session, after, limit=10)
+        if not page:
+            break
+        pages.append(page)
+        after = (page[-1].alert.created_at, page[-1].alert.id)
+    alerts = [details.alert for page in pages for details in page]
+    assert [len(page) for page in pages] == [10, 10, 7]
+    assert len({a.id for a in alerts}) == 27
+    keys = [(a.created_at, a.id) for a in alerts]
+    assert keys == sorted(keys, reverse=True)
+    assert all(d.trigger.id == d.alert.trigger_id for page in pages for d in page)
@@ -1,15 +1,18 @@
 """
 This module contains general-scope fixtures.
 """
+import json
 from typing import List
-from datetime import datetime
+from types import SimpleNamespace
+from datetime import datetime, timedelta
 from contextlib import contextmanager
 
 import pytest
+import tinvest
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, Session
 
-from api.src import schemas, database
+from api.src import schemas, database, tinkoff
 
 
 @pytest.fixture
@@ -56,13 +59,13 @@ def alerts(users, triggers) -> List[schemas.Alert]:
             "id": 0,
             "user_id": users[0].id,
             "trigger_id": triggers[0].id,
-            "created_at": datetime.now(),
+            "created_at": datetime.utcnow(),
         },
         {
             "id": 1,
             "user_id": users[0].id,
             "trigger_id": triggers[1].id,
-            "created_at": datetime.now(),
+            "created_at": datetime.utcnow(),
         },
     ]
     return [schemas.Alert(**alert) for alert in alerts]
@@ -92,3 +95,49 @@ def get_db_session(session):
         yield session
 
     return fn()
+
+
+class FakeMarket:
+    """
+    Stand-in for the Tinkoff API that counts upstream calls.
+    """
+
+    def __init__(self, prices: dict):
+        self.prices = prices
+        self.candle_calls = 0
+        self.list_calls = 0
+
+    def get_market_candles(self, figi, from_, to, interval):
+        self.candle_calls += 1
+        price = self.prices[figi.replace("FIGI-", "")]
+        days = (to - from_).days
+        candles = [
+            SimpleNamespace(h=price + 1, l=price - 1, time=to - timedelta(days=d))
+            for d in range(days, 0, -1)
+        ]
+        return SimpleNamespace(payload=SimpleNamespace(candles=candles))
+
+    def post(self, url, **kwargs):
+        self.list_calls += 1
+        values = [
+            {"symbol": {"ticker": t}, "price": {"value": self.prices[t]}}
+            for t in kwargs["json"]["tickers"]
+        ]
+        return SimpleNamespace(text=json.dumps({"payload": {"values": values}}))
+
+
+@pytest.fixture
+def fake_market(monkeypatch) -> FakeMarket:
+    market = FakeMarket({"TSLA": 800.0, "BABA": 200.0, "GOOG": 1500.0})
+    monkeypatch.setattr(tinkoff.get_transport(), "post", market.post)
+    return market
+
+
+@pytest.fixture
+def portfolio_markets() -> dict:
+    return {
+        tinvest.schemas.InstrumentType.stock: [
+            ("TSLA", "FIGI-TSLA"),
+            ("BABA", "FIGI-BABA"),
+        ]
+    }